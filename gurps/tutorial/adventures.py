@@ -0,0 +1,335 @@
+# adventures.py
+# Adventure content as data: one JSON (or YAML, with PyYAML installed) file per
+# adventure in adventures/, validated on load and rendered into the viewer's
+# right-hand pane through a Jinja template that is compiled once per process.
+# Rendered markup is memoised by content hash, so switching between adventures
+# (or PDFs) never renders an unchanged file twice. The bundled adventures are
+# JSON so that the app needs nothing beyond Streamlit to open them.
+#
+# Rule links are written [text](#page), with the page number of the PDF named
+# under "pdf"; **bold** is the only other markup (link_check.py verifies the
+# page numbers against the rulebook). A character's "combat" and each scene's
+# "sim" steps feed encounter_sim.py and are not shown in the viewer; a roll
+# whose failure only costs HP or FP is "optional": it counts towards the
+# losses, not against success.
+#
+#     python adventures.py adventures/tomb_of_the_silver_serpent.json > tomb.html
+
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from numbers import Real
+from pathlib import Path
+
+import jinja2
+from markupsafe import Markup, escape
+
+try:
+    import yaml
+except ImportError:  # optional dependency; JSON adventures still load
+    yaml = None
+
+ADVENTURE_DIR = Path(__file__).with_name("adventures")
+TEMPLATE_DIR = Path(__file__).with_name("templates")
+ADVENTURE_TEMPLATE = "adventure.html.j2"
+SUFFIXES = (".yaml", ".yml", ".json")
+
+# Stat block order; anything else follows in a last group.
+STAT_GROUPS = (("ST", "DX", "IQ", "HT"), ("HP", "FP"), ("Basic Speed", "Move", "Dodge"), ("DR",))
+
+MEMO_SIZE = 32
+
+# [Fright Check p.24](#24) -> a rule link; **text** -> bold.
+LINK_RE = re.compile(r"\[([^\[\]]+)\]\(#(\d+)\)")
+_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+_YAML_TITLE_RE = re.compile(r"""^title:\s*(["']?)(.+?)\1\s*$""", re.MULTILINE)
+_JSON_TITLE_RE = re.compile(r'"title"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+class AdventureError(ValueError):
+    """An adventure file that cannot be parsed or fails validation."""
+
+    def __init__(self, source, problems):
+        self.source = str(source)
+        self.problems = [problems] if isinstance(problems, str) else list(problems)
+        super().__init__(f"{self.source}: " + "; ".join(self.problems))
+
+
+@dataclass(frozen=True)
+class Adventure:
+    path: Path
+    sha: str  # hash of the file contents and the template
+    title: str
+    pdf: str  # default rulebook file name
+    data: dict
+    markup: str  # rendered right-hand pane
+
+
+# ---------- discovery (cheap: no parsing) ----------
+
+def list_adventures(root=ADVENTURE_DIR):
+    """``{path: title}`` for every adventure file under ``root``, sorted by title.
+
+    Titles come from a quick look at the top of each file, so the selector
+    costs the same however large the adventures are.
+    """
+    found = {}
+    for path in sorted(Path(root).glob("*")):
+        if path.suffix.lower() in SUFFIXES and not path.name.startswith("."):
+            found[path] = _peek_title(path)
+    return dict(sorted(found.items(), key=lambda kv: kv[1].lower()))
+
+
+def _peek_title(path, nbytes=2048):
+    try:
+        with open(path, encoding="utf-8") as f:
+            head = f.read(nbytes)
+    except OSError:
+        head = ""
+    if path.suffix.lower() == ".json":
+        m = _JSON_TITLE_RE.search(head)
+        title = json.loads(m.group(1)) if m else None
+    else:
+        m = _YAML_TITLE_RE.search(head)
+        title = m.group(2) if m else None
+    return title or path.stem.replace("_", " ").title()
+
+
+# ---------- parsing and validation ----------
+
+def parse(text, source):
+    if Path(source).suffix.lower() == ".json":
+        try:
+            return json.loads(text)
+        except ValueError as exc:
+            raise AdventureError(source, f"invalid JSON: {exc}") from None
+    if yaml is None:
+        raise AdventureError(source, "YAML adventures need PyYAML (pip install pyyaml)")
+    try:
+        return yaml.safe_load(text)
+    except yaml.YAMLError as exc:
+        raise AdventureError(source, f"invalid YAML: {exc}") from None
+
+
+def validate(data, source=""):
+    """Check the structure of an adventure; return it with optional keys filled in.
+
+    Collects every problem before raising, so one run lists all of them.
+    """
+    problems = []
+
+    def check_text(value, where, required=False):
+        if value is None:
+            if required:
+                problems.append(f"{where} is required")
+        elif not isinstance(value, str):
+            problems.append(f"{where} must be a string")
+        else:
+            for m in LINK_RE.finditer(value):
+                if int(m.group(2)) < 1:
+                    problems.append(f"{where}: link {m.group(0)!r} points before page 1")
+            if "](" in LINK_RE.sub("", value):
+                problems.append(f"{where}: malformed link (expected [text](#page))")
+
+    def check_item(value, where):
+        check_text(value, where, required=True)
+
+    def check_list(obj, key, where, check=check_item):
+        items = obj.setdefault(key, [])
+        if not isinstance(items, list):
+            problems.append(f"{where}{key} must be a list")
+            obj[key] = []
+        for i, item in enumerate(obj[key]):
+            check(item, f"{where}{key}[{i}]")
+
+    def check_mappings(obj, key, where, many=False):
+        # Simulator data (combat, sim): only the shape is checked here;
+        # encounter_sim reports bad values when it compiles the scene.
+        value = obj.get(key)
+        if value is None:
+            return
+        if many and not (isinstance(value, list) and all(isinstance(v, dict) for v in value)):
+            problems.append(f"{where}.{key} must be a list of mappings")
+        elif not many and not isinstance(value, dict):
+            problems.append(f"{where}.{key} must be a mapping")
+
+    def check_stat_block(obj, where):
+        if not isinstance(obj, dict):
+            problems.append(f"{where} must be a mapping")
+            return
+        check_text(obj.get("name"), f"{where}.name", required=True)
+        stats = obj.setdefault("stats", {})
+        if not isinstance(stats, dict) or not all(
+            isinstance(k, str) and isinstance(v, Real) and not isinstance(v, bool) for k, v in stats.items()
+        ):
+            problems.append(f"{where}.stats must map stat names to numbers")
+        for key in ("heading", "ref", "notes", "kit"):
+            check_text(obj.get(key), f"{where}.{key}")
+        for key in ("advantages", "skills"):
+            check_list(obj, key, f"{where}.")
+        check_mappings(obj, "combat", where)
+
+    if not isinstance(data, dict):
+        raise AdventureError(source, "top level must be a mapping")
+    for key in ("title", "pdf"):
+        check_text(data.get(key), key, required=True)
+    for key in ("subtitle", "tagline", "intro"):
+        check_text(data.get(key), key)
+    check_list(data, "characters", "", check_stat_block)
+
+    scenes = data.get("scenes")
+    if not isinstance(scenes, list) or not scenes:
+        problems.append("scenes must be a non-empty list")
+        scenes = data["scenes"] = []
+    seen = set()
+    for i, scene in enumerate(scenes):
+        where = f"scenes[{i}]"
+        if not isinstance(scene, dict):
+            problems.append(f"{where} must be a mapping")
+            continue
+        sid = scene.get("id")
+        if not isinstance(sid, str) or not re.fullmatch(r"[A-Za-z][\w-]*", sid):
+            problems.append(f"{where}.id must be a short name (letters, digits, - or _)")
+        elif sid in seen:
+            problems.append(f"{where}.id {sid!r} is used twice")
+        else:
+            seen.add(sid)
+        check_text(scene.get("title"), f"{where}.title", required=True)
+        for key in ("short", "read_aloud"):
+            check_text(scene.get(key), f"{where}.{key}")
+        for key in ("tags", "text", "list", "notes"):
+            check_list(scene, key, f"{where}.")
+        check_list(scene, "creatures", f"{where}.", check_stat_block)
+        check_mappings(scene, "sim", where, many=True)
+
+    if problems:
+        raise AdventureError(source, problems)
+    return data
+
+
+# ---------- rendering ----------
+
+def links(value):
+    """Escape ``value`` and turn its [text](#page) and **bold** markup into HTML."""
+    out = str(escape(value))
+    out = LINK_RE.sub(r'<span class="pdf" data-page="\2">\1</span>', out)
+    return Markup(_BOLD_RE.sub(r"<strong>\1</strong>", out))
+
+
+def statline(stats):
+    """``{"ST": 11, "DX": 12, "HP": 11}`` -> ``"ST 11, DX 12; HP 11"``."""
+    def fmt(name, value):
+        return f"{name} {value:.2f}" if isinstance(value, float) else f"{name} {value}"
+
+    groups = [[k for k in group if k in stats] for group in STAT_GROUPS]
+    known = {k for group in STAT_GROUPS for k in group}
+    groups.append([k for k in stats if k not in known])
+    return "; ".join(", ".join(fmt(k, stats[k]) for k in group) for group in groups if group)
+
+
+_env = None
+_template = None
+_template_sha = ""
+_memo = OrderedDict()
+_lock = threading.Lock()
+
+
+def template():
+    """The adventure template, compiled on first use and kept for the process."""
+    global _env, _template, _template_sha
+    with _lock:
+        if _template is None:
+            _env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(TEMPLATE_DIR),
+                autoescape=True,
+                trim_blocks=True,
+                lstrip_blocks=True,
+                auto_reload=False,
+            )
+            _env.filters["links"] = links
+            _env.filters["statline"] = statline
+            _template = _env.get_template(ADVENTURE_TEMPLATE)
+            source = (TEMPLATE_DIR / ADVENTURE_TEMPLATE).read_bytes()
+            _template_sha = hashlib.sha256(source).hexdigest()
+        return _template, _template_sha
+
+
+def render(data):
+    tmpl, _ = template()
+    return tmpl.render(**data)
+
+
+def load(path):
+    """Parse, validate and render the adventure at ``path``.
+
+    Results are memoised by the SHA-256 of the file (and of the template), so
+    reloading or switching back to an unchanged adventure is a hash and a
+    dictionary lookup.
+    """
+    path = Path(path)
+    raw = path.read_bytes()
+    _, template_sha = template()
+    sha = hashlib.sha256(raw + template_sha.encode("ascii")).hexdigest()
+    with _lock:
+        adventure = _memo.get(sha)
+        if adventure is not None:
+            _memo.move_to_end(sha)
+            return adventure
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        raise AdventureError(path, f"not UTF-8: {exc}") from None
+    data = validate(parse(text, path), path)
+    adventure = Adventure(
+        path=path, sha=sha, title=data["title"], pdf=data["pdf"], data=data, markup=render(data)
+    )
+    with _lock:
+        _memo[sha] = adventure
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return adventure
+
+
+def markup_for(path):
+    """Rule-link markup of ``path``: rendered for adventure files, as-is otherwise.
+
+    Lets the command-line tools take either an adventure or an HTML file.
+    """
+    path = Path(path)
+    if path.suffix.lower() in SUFFIXES:
+        return load(path).markup
+    return path.read_text(encoding="utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate adventure files and print their rendered HTML.")
+    parser.add_argument("adventure", type=Path, nargs="*",
+                        help=f"adventure files (default: everything in {ADVENTURE_DIR.name}/)")
+    parser.add_argument("--check", action="store_true", help="only validate, do not print HTML")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for path in args.adventure or list(list_adventures()):
+        try:
+            adventure = load(path)
+        except AdventureError as exc:
+            failed += 1
+            print(exc.source, file=sys.stderr)
+            for problem in exc.problems:
+                print(f"  {problem}", file=sys.stderr)
+            continue
+        if args.check:
+            n = len(LINK_RE.findall(path.read_text(encoding="utf-8")))
+            print(f"ok  {path}  {adventure.title!r}: {len(adventure.data['scenes'])} scenes, {n} links")
+        else:
+            print(adventure.markup)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+# benchmark.py
+# Page-load and rerun cost of the viewer, measured headlessly through
+# Streamlit's AppTest: wall time of the first run after picking a rulebook and
+# of repeated no-change reruns, peak memory, and the size of the HTML handed
+# to the component, across PDF sizes (the Lite file plus synthetic 50-200 MB
+# books) and delivery modes. Each scenario runs in a fresh process so startup
+# and peak memory are not polluted by the previous one.
+#
+# Run from the folder holding the rulebook, like the app:
+#
+#     python gurps/tutorial/benchmark.py --out bench.json
+#     python gurps/tutorial/benchmark.py --baseline gurps/tutorial/bench/baseline.json
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from page_render import CACHE_DIR
+
+APP = Path(__file__).with_name("tomb_of_the_silver_serpent.py")
+BASELINE = Path(__file__).with_name("bench") / "baseline.json"
+LITE_PDF = Path("GURPS 4e - Lite.pdf")
+DATA_DIR = CACHE_DIR / "bench"
+
+SIZES_MB = (50, 100, 200)
+MODES = {"range": "Range requests (streamed)", "inline": "Inline (base64)"}
+RERUNS = 5
+
+# A metric regresses when it grows by more than the tolerance *and* by more
+# than its noise floor (seconds or bytes).
+TOLERANCE = 0.20
+NOISE_FLOOR = {"first_s": 0.05, "rerun_median_s": 0.01, "peak_rss": 16 << 20, "html_bytes": 1024}
+
+
+# ---------- synthetic rulebooks ----------
+
+def synthetic_pdf(path, size, pages=32, seed=0):
+    """Write a valid ``pages``-page PDF of roughly ``size`` bytes to ``path``.
+
+    Each page carries a line of text and an uncompressed greyscale image of
+    random (incompressible) bytes, streamed to disk a page at a time.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    per_page = max(1, size // pages)
+    width = max(1, int(per_page ** 0.5))
+    height = max(1, per_page // width)
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    offsets = {}
+    with open(tmp, "wb") as f:
+        def obj(num, body, stream=None):
+            offsets[num] = f.tell()
+            f.write(f"{num} 0 obj\n".encode("ascii"))
+            if stream is None:
+                f.write(body.encode("ascii") + b"\nendobj\n")
+            else:
+                f.write(body[:-2].encode("ascii") + f" /Length {len(stream)} >>\nstream\n".encode("ascii"))
+                f.write(stream)
+                f.write(b"\nendstream\nendobj\n")
+
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        first = 4
+        kids = " ".join(f"{first + 3 * i} 0 R" for i in range(pages))
+        obj(1, "<< /Type /Catalog /Pages 2 0 R >>")
+        obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>")
+        obj(3, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        for i in range(pages):
+            page, content, image = first + 3 * i, first + 3 * i + 1, first + 3 * i + 2
+            obj(page, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                      f"/Resources << /Font << /F1 3 0 R >> /XObject << /Im0 {image} 0 R >> >> "
+                      f"/Contents {content} 0 R >>")
+            text = f"BT /F1 18 Tf 72 720 Td (Synthetic rulebook page {i + 1}: fright check, hiking) Tj ET "
+            obj(content, "<< >>", f"q 468 0 0 560 72 120 cm /Im0 Do Q {text}".encode("ascii"))
+            obj(image, f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                       f"/ColorSpace /DeviceGray /BitsPerComponent 8 >>", rng.bytes(width * height))
+        xref = f.tell()
+        count = 3 + 3 * pages + 1
+        f.write(f"xref\n0 {count}\n0000000000 65535 f \n".encode("ascii"))
+        for num in range(1, count):
+            f.write(f"{offsets[num]:010d} 00000 n \n".encode("ascii"))
+        f.write(f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
+    os.replace(tmp, path)
+    return path
+
+
+def scenario_pdfs(sizes_mb, data_dir=DATA_DIR):
+    """``{label: path}``: a private copy of the Lite PDF plus one synthetic book per size."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    if not LITE_PDF.exists():
+        raise SystemExit(f"Cannot find {LITE_PDF} in {Path('.').resolve()}; run from the app's folder.")
+    pdfs = {"lite": data_dir / "lite.pdf"}
+    if not pdfs["lite"].exists() or pdfs["lite"].stat().st_size != LITE_PDF.stat().st_size:
+        shutil.copyfile(LITE_PDF, pdfs["lite"])
+    for mb in sizes_mb:
+        path = pdfs[f"{mb}MB"] = data_dir / f"synthetic-{mb}mb.pdf"
+        if not path.exists():
+            print(f"writing {path} ...", file=sys.stderr)
+            synthetic_pdf(path, mb * 1_000_000)
+    return pdfs
+
+
+def _forget_indexes(pdf):
+    # Search/keyword indexes persist beside the PDF; drop them so every
+    # scenario pays for its first load.
+    for stale in pdf.parent.glob(f".{pdf.stem}.*.json.gz"):
+        stale.unlink(missing_ok=True)
+
+
+# ---------- one scenario (child process) ----------
+
+def _rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kB on Linux
+
+
+def _payload(at):
+    """The ``srcdoc`` handed to ``st.components.v1.html`` in this run."""
+    for node in at.main.children.values():
+        if getattr(node, "type", None) == "iframe":
+            return node.proto.srcdoc
+    return ""
+
+
+def measure(pdf, mode, reruns, timeout=600):
+    """Drive the app through one scenario in this process; return its metrics."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP.resolve()), default_timeout=timeout)
+    t0 = time.perf_counter()
+    at.run()
+    startup = time.perf_counter() - t0
+    if at.exception:
+        raise RuntimeError(f"app failed on startup: {at.exception[0].value}")
+
+    at.sidebar.text_input[0].set_value(str(Path(pdf).resolve()))
+    next(r for r in at.sidebar.radio if r.label == "PDF delivery").set_value(MODES[mode])
+    t0 = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - t0
+    problems = [e.value for e in at.exception] + [e.value for e in at.error]
+    if problems:
+        raise RuntimeError(f"app failed for {pdf} ({mode}): {problems[0]}")
+    html_bytes = len(_payload(at).encode("utf-8"))
+
+    times = []
+    for _ in range(reruns):
+        t0 = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - t0)
+    rss = _rss()
+    return {
+        "startup_s": startup,
+        "first_s": first,
+        "rerun_s": times,
+        "rerun_median_s": statistics.median(times) if times else None,
+        "rerun_max_s": max(times) if times else None,
+        "html_bytes": html_bytes,
+        "rss_after": rss,
+        "peak_rss": max(rss, _peak_rss()),
+    }
+
+
+def run_scenario(label, pdf, mode, reruns):
+    """Measure one scenario in a fresh interpreter.
+
+    A scenario that crashes (e.g. killed for running out of memory) is
+    reported with an ``error`` instead of metrics.
+    """
+    _forget_indexes(pdf)
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--child", str(pdf), mode, str(reruns)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    row = {"pdf": label, "pdf_bytes": Path(pdf).stat().st_size, "mode": mode}
+    if proc.returncode == 0:
+        return {**row, **json.loads(proc.stdout.strip().splitlines()[-1])}
+    if proc.returncode < 0:
+        error = f"killed by signal {-proc.returncode}" + (" (out of memory?)" if proc.returncode == -9 else "")
+    else:
+        lines = [l for l in proc.stderr.splitlines() if l.strip()]
+        error = lines[-1] if lines else f"exit status {proc.returncode}"
+    return {**row, "error": error}
+
+
+# ---------- reporting ----------
+
+def environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        rev = ""
+    try:
+        import streamlit
+        st_version = streamlit.__version__
+    except ImportError:
+        st_version = ""
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": rev,
+        "python": platform.python_version(),
+        "streamlit": st_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Rows of ``(scenario, metric, old, new, regressed)`` against a baseline run."""
+    old = {(r["pdf"], r["mode"]): r for r in baseline["results"]}
+    rows = []
+    for r in results:
+        ref = old.get((r["pdf"], r["mode"]))
+        if ref is None:
+            continue
+        if "error" in r and "error" not in ref:
+            rows.append((f"{r['pdf']}/{r['mode']}", "error", r["error"], None, True))
+            continue
+        for metric, floor in NOISE_FLOOR.items():
+            a, b = ref.get(metric), r.get(metric)
+            if a is None or b is None:
+                continue
+            rows.append((f"{r['pdf']}/{r['mode']}", metric, a, b, b > a * (1 + tolerance) and b - a > floor))
+    return rows
+
+
+def _fmt(metric, value):
+    if metric.endswith("_s"):
+        return f"{value * 1000:.0f} ms"
+    if value < 1e6:
+        return f"{value / 1e3:.1f} kB"
+    return f"{value / 1e6:.1f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark page-load and rerun cost of the viewer.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES_MB)),
+                        help="synthetic rulebook sizes in MB (empty for the Lite PDF only)")
+    parser.add_argument("--modes", default=",".join(MODES), help="delivery modes to measure")
+    parser.add_argument("--reruns", type=int, default=RERUNS)
+    parser.add_argument("--out", type=Path, help="write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="compare against an earlier --out file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed growth, e.g. 0.2 = 20%%")
+    parser.add_argument("--update-baseline", action="store_true", help=f"also write the results to {BASELINE}")
+    parser.add_argument("--child", nargs=3, metavar=("PDF", "MODE", "RERUNS"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        pdf, mode, reruns = args.child
+        print(json.dumps(measure(pdf, mode, int(reruns))))
+        return 0
+
+    modes = [m for m in args.modes.split(",") if m]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = []
+    print(f"{'scenario':<16} {'startup':>9} {'first':>9} {'rerun':>9} {'HTML':>10} {'peak RSS':>10}")
+    for label, pdf in scenario_pdfs(sizes).items():
+        for mode in modes:
+            r = run_scenario(label, pdf, mode, args.reruns)
+            results.append(r)
+            if "error" in r:
+                print(f"{label + '/' + mode:<16} failed: {r['error']}")
+                continue
+            print(f"{label + '/' + mode:<16} {_fmt('_s', r['startup_s']):>9} {_fmt('_s', r['first_s']):>9} "
+                  f"{_fmt('_s', r['rerun_median_s']):>9} {_fmt('', r['html_bytes']):>10} "
+                  f"{_fmt('', r['peak_rss']):>10}")
+
+    report = {"environment": environment(), "reruns": args.reruns, "results": results}
+    for path in filter(None, (args.out, BASELINE if args.update_baseline else None)):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=1), encoding="utf-8")
+
+    if args.baseline:
+        rows = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        regressions = [row for row in rows if row[4]]
+        print(f"\nagainst {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for scenario, metric, a, b, bad in rows:
+            if metric == "error":
+                print(f"  REGRESSED {scenario:<16} now fails: {a}")
+                continue
+            change = (b - a) / a if a else 0.0
+            print(f"  {'REGRESSED' if bad else 'ok':<9} {scenario:<16} {metric:<15} "
+                  f"{_fmt(metric, a):>10} -> {_fmt(metric, b):>10} ({change:+.0%})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
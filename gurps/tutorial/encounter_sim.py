@@ -0,0 +1,539 @@
+# encounter_sim.py
+# Monte Carlo odds for an adventure's encounters. Each scene's `sim` steps
+# (skill rolls, quick contests, a fight against one of its creatures) are played
+# N times at once with NumPy: batched 3d6 success rolls, quick contests, damage
+# after DR and wounding modifiers, shock, consciousness and death checks, and
+# poison cycles. Results are tallied into small mergeable histograms, so big
+# sweeps can be split across a process pool.
+#
+#     python encounter_sim.py adventures/tomb_of_the_silver_serpent.json -n 200000 --workers 4
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+
+MAX_TURNS = 100
+CHUNK = 250_000  # attempts per pool task
+
+# Multiplier applied to penetrating damage, by damage type (p.29).
+WOUNDING = {"cr": 1.0, "cut": 1.5, "imp": 2.0, "pi": 1.0, "burn": 1.0, "tox": 1.0, "": 1.0}
+
+_DICE_RE = re.compile(r"^\s*(\d+)d\s*([+-]\s*\d+)?\s*(\w+)?\s*$")
+_FACES = np.arange(1, 7, dtype=np.int8)
+# All 216 outcomes of 3d6; one uniform draw per roll indexes into it.
+_3D6 = (_FACES[:, None, None] + _FACES[None, :, None] + _FACES[None, None, :]).ravel()
+
+
+# ---------- dice ----------
+
+@dataclass(frozen=True)
+class Dice:
+    n: int = 0
+    adds: int = 0
+    kind: str = ""  # damage type: cr, cut, imp, ... ("" for untyped harm)
+
+    @classmethod
+    def parse(cls, spec):
+        """``"1d-1 imp"`` -> ``Dice(1, -1, "imp")``; a bare number is a flat amount."""
+        if isinstance(spec, int):
+            return cls(0, spec)
+        m = _DICE_RE.match(str(spec))
+        if not m or (m.group(3) and m.group(3) not in WOUNDING):
+            raise ValueError(f"bad dice {spec!r} (expected e.g. '1d-1 imp')")
+        return cls(int(m.group(1)), int((m.group(2) or "0").replace(" ", "")), m.group(3) or "")
+
+    def roll(self, rng, size):
+        total = np.full(size, self.adds, dtype=np.int32)
+        if self.n:
+            total += rng.integers(1, 7, size=(size, self.n), dtype=np.int8).sum(axis=1, dtype=np.int32)
+        # Crushing (and plain harm) can roll zero; other attacks do at least 1.
+        return np.maximum(total, 0 if self.kind in ("cr", "") else 1)
+
+
+def roll_3d6(rng, size):
+    return _3D6[rng.integers(0, 216, size=size, dtype=np.uint8)]
+
+
+def success_roll(rng, target, size):
+    """Roll 3d6 against ``target`` (scalar or array): ``(ok, margin, critical, fumble)``.
+
+    3-4 always succeed and are critical (5 and 6 too at 15+ and 16+); 17-18
+    always fail, and 18, 17 at 15 or less, or missing by 10+ are critical
+    failures (p.3).
+    """
+    roll = roll_3d6(rng, size).astype(np.int16)
+    target = np.asarray(target, dtype=np.int16)
+    margin = target - roll
+    critical = (roll <= 4) | ((roll == 5) & (target >= 15)) | ((roll == 6) & (target >= 16))
+    fumble = (roll == 18) | ((roll == 17) & (target <= 15)) | (margin <= -10)
+    ok = critical | ((margin >= 0) & (roll < 17))
+    return ok, margin, critical, fumble & ~critical
+
+
+def quick_contest(rng, a, b, size):
+    """+1 where ``a`` wins, -1 where ``b`` wins, 0 for a tie (p.3)."""
+    ok_a, margin_a, _, _ = success_roll(rng, a, size)
+    ok_b, margin_b, _, _ = success_roll(rng, b, size)
+    # A success beats a failure; otherwise the better margin wins.
+    score = (ok_a.astype(np.int16) - ok_b) * 100 + (margin_a - margin_b)
+    return np.sign(score).astype(np.int8)
+
+
+def injury(basic, dr, kind):
+    """Penetrating damage times the wounding modifier, at least 1 if any got through."""
+    penetrating = np.maximum(basic - dr, 0)
+    wound = np.floor(penetrating * WOUNDING[kind]).astype(np.int32)
+    return np.where(penetrating > 0, np.maximum(wound, 1), 0)
+
+
+# ---------- combatants and steps ----------
+
+@dataclass(frozen=True)
+class Poison:
+    resist: int = 0  # modifier to the HT roll
+    cycles: int = 1
+    damage: Dice = Dice(0, 1)
+
+
+@dataclass(frozen=True)
+class Combatant:
+    name: str
+    hp: int
+    ht: int
+    skill: int = 10
+    damage: Dice = Dice(1, 0, "cr")
+    defense: int = 0  # best active defense; 0 means none
+    dr: int = 0
+    all_out: float = 0.0  # chance per turn of an All-Out Attack (Determined: +4, no defense)
+    poison: Poison = None  # delivered by an attack that penetrates DR
+
+    @classmethod
+    def from_block(cls, block):
+        """Build from an adventure stat block (its ``stats`` and ``combat``)."""
+        stats, combat = block.get("stats", {}), block.get("combat") or {}
+        attack = combat.get("attack") or {}
+        poison = attack.get("poison")
+        return cls(
+            name=block["name"],
+            hp=int(stats.get("HP", stats.get("ST", 10))),
+            ht=int(stats.get("HT", 10)),
+            skill=int(attack.get("skill", stats.get("DX", 10))),
+            damage=Dice.parse(attack.get("damage", "1d-2 cr")),
+            defense=int(combat.get("defense", stats.get("Dodge", 0))),
+            dr=int(combat.get("dr", stats.get("DR", 0))),
+            all_out=float(combat.get("all_out_attack", 0.0)),
+            poison=_poison(poison) if poison else None,
+        )
+
+
+def _poison(spec):
+    return Poison(int(spec.get("resist", 0)), int(spec.get("cycles", 1)), Dice.parse(spec.get("damage", 1)))
+
+
+@dataclass(frozen=True)
+class Effect:
+    hp: Dice = None  # typed damage is reduced by the character's DR
+    fp: Dice = None
+    poison: Poison = None
+
+    @classmethod
+    def parse(cls, spec):
+        if not spec:
+            return None
+        unknown = set(spec) - {"hp", "fp", "poison"}
+        if unknown:
+            raise ValueError(f"unknown effect key(s) {sorted(unknown)}")
+        return cls(
+            hp=Dice.parse(spec["hp"]) if "hp" in spec else None,
+            fp=Dice.parse(spec["fp"]) if "fp" in spec else None,
+            poison=_poison(spec["poison"]) if "poison" in spec else None,
+        )
+
+
+@dataclass(frozen=True)
+class Step:
+    kind: str  # roll | contest | fight
+    name: str
+    skill: int = 10
+    vs: int = 10  # contests: the opposing skill
+    times: int = 1  # rolls that must all succeed
+    retries: int = 0  # extra attempts per roll after a failure
+    optional: bool = False  # failing it does not fail the scene
+    fail: Effect = None
+    critfail: Effect = None
+    foe: Combatant = None
+
+
+@dataclass(frozen=True)
+class Encounter:
+    id: str
+    title: str
+    pc: Combatant
+    steps: tuple
+
+
+def compile_encounters(data):
+    """The simulatable scenes of a validated adventure, in order.
+
+    The first quick-start character plays every scene; a ``fight`` step names
+    one of the scene's creatures. Raises ValueError naming the bad step.
+    """
+    if not data.get("characters"):
+        return []
+    pc = Combatant.from_block(data["characters"][0])
+    out = []
+    for scene in data["scenes"]:
+        steps = []
+        creatures = {c["name"]: c for c in scene.get("creatures", [])}
+        for i, spec in enumerate(scene.get("sim") or []):
+            try:
+                steps.append(_step(spec, creatures))
+            except (KeyError, TypeError, ValueError) as exc:
+                raise ValueError(f"scenes[{scene['id']}].sim[{i}]: {exc}") from None
+        if steps:
+            out.append(Encounter(scene["id"], scene["title"], pc, tuple(steps)))
+    return out
+
+
+def _step(spec, creatures):
+    kinds = [k for k in ("roll", "contest", "fight") if k in spec]
+    if len(kinds) != 1:
+        raise ValueError("needs exactly one of roll, contest or fight")
+    kind = kinds[0]
+    name = str(spec[kind])
+    if kind == "fight":
+        if name not in creatures:
+            raise ValueError(f"no creature named {name!r} in this scene")
+        return Step("fight", name, foe=Combatant.from_block(creatures[name]), optional=bool(spec.get("optional")))
+    return Step(
+        kind,
+        name,
+        skill=int(spec["skill"]),
+        vs=int(spec.get("vs", 10)),
+        times=int(spec.get("times", 1)),
+        retries=int(spec.get("retries", 0)),
+        optional=bool(spec.get("optional")),
+        fail=Effect.parse(spec.get("fail") or spec.get("lose")),
+        critfail=Effect.parse(spec.get("critfail")),
+    )
+
+
+# ---------- simulation ----------
+
+@dataclass
+class Outcome:
+    """Per-attempt results of one batch."""
+
+    success: np.ndarray
+    hp_loss: np.ndarray
+    fp_loss: np.ndarray
+    turns: np.ndarray
+    dead: np.ndarray
+
+    @classmethod
+    def empty(cls, n):
+        return cls(np.ones(n, bool), np.zeros(n, np.int32), np.zeros(n, np.int32),
+                   np.zeros(n, np.int32), np.zeros(n, bool))
+
+
+def _apply(rng, effect, pc, mask, out):
+    """Apply ``effect`` to the attempts selected by boolean ``mask``."""
+    if effect is None or not mask.any():
+        return
+    k = int(mask.sum())
+    if effect.hp is not None:
+        out.hp_loss[mask] += injury(effect.hp.roll(rng, k), pc.dr if effect.hp.kind else 0, effect.hp.kind)
+    if effect.fp is not None:
+        out.fp_loss[mask] += effect.fp.roll(rng, k)
+    if effect.poison is not None:
+        out.hp_loss[mask] += poison_cycles(rng, effect.poison, pc.ht, k)
+
+
+def poison_cycles(rng, poison, ht, size):
+    """Damage from ``poison.cycles`` HT rolls, each failure doing ``poison.damage``."""
+    total = np.zeros(size, np.int32)
+    for _ in range(poison.cycles):
+        ok, _, _, _ = success_roll(rng, ht + poison.resist, size)
+        total += np.where(ok, 0, poison.damage.roll(rng, size))
+    return total
+
+
+def simulate_fight(rng, a, b, n, max_turns=MAX_TURNS):
+    """``n`` duels of ``a`` against ``b`` (``a`` strikes first each turn).
+
+    Returns ``(a_won, a_hp_loss, turns, a_dead)``. Each side rolls to hit with
+    its shock penalty from the last turn, the target makes its best active
+    defense (none after an All-Out Attack), and injury is damage after DR times
+    the wounding modifier. At 0 HP or less a fighter rolls HT every turn to stay
+    conscious, and makes a death check whenever a blow takes it past another
+    multiple of -HP (p.29-30). Poison from ``b``'s attack runs its cycles after
+    the fight.
+    """
+    side = (a, b)
+    pos = np.arange(n)  # original index of each fight still running
+    hp = [np.full(n, a.hp, np.int32), np.full(n, b.hp, np.int32)]
+    shock = [np.zeros(n, np.int16), np.zeros(n, np.int16)]
+    exposed = [np.zeros(n, bool), np.zeros(n, bool)]  # no defense this turn (All-Out Attack)
+    poisoned = np.zeros(n, bool)
+
+    a_won = np.zeros(n, bool)
+    a_dead = np.zeros(n, bool)
+    a_hp = np.full(n, a.hp, np.int32)
+    turns = np.full(n, max_turns, np.int32)
+
+    for turn in range(1, max_turns + 1):
+        ended = np.zeros(len(pos), bool)
+        for me, you in ((0, 1), (1, 0)):
+            att, tgt = side[me], side[you]
+            live = ~ended
+            # Staying conscious at 0 HP or less, -1 per full multiple of HP below zero.
+            low = live & (hp[me] <= 0)
+            if low.any():
+                ok, _, _, _ = success_roll(rng, att.ht - (-hp[me][low]) // att.hp, int(low.sum()))
+                out = np.zeros(len(pos), bool)
+                out[low] = ~ok
+                a_won[pos[out]] = me == 1
+                ended |= out
+                live &= ~out
+            k = int(live.sum())
+            if not k:
+                continue
+            skill = att.skill - shock[me][live]
+            aoa = rng.random(k) < att.all_out if att.all_out else np.zeros(k, bool)
+            shock[me][live] = 0
+            exposed[me][live] = aoa
+            hit, _, critical, _ = success_roll(rng, skill + 4 * aoa, k)
+            if tgt.defense:
+                defend = hit & ~critical & ~exposed[you][live]
+                if defend.any():
+                    ok, _, _, _ = success_roll(rng, tgt.defense, int(defend.sum()))
+                    hit[defend] = ~ok
+            wound = np.where(hit, injury(att.damage.roll(rng, k), tgt.dr, att.damage.kind), 0)
+            before = hp[you][live]
+            after = before - wound
+            hp[you][live] = after
+            shock[you][live] = np.minimum(wound, 4)
+            if me == 1 and att.poison is not None:
+                poisoned[pos[live]] |= wound > 0
+            # A death check at each new multiple of -HP; automatic death at -5xHP.
+            crossed = (after <= -tgt.hp) & ((-after) // tgt.hp > np.maximum(-before, 0) // tgt.hp)
+            dead = after <= -5 * tgt.hp
+            if crossed.any():
+                ok, _, _, _ = success_roll(rng, tgt.ht, int(crossed.sum()))
+                dead[crossed] |= ~ok
+            if dead.any():
+                out = np.zeros(len(pos), bool)
+                out[live] = dead
+                a_won[pos[out]] = you == 1
+                a_dead[pos[out]] = you == 0
+                ended |= out
+        if ended.any():
+            turns[pos[ended]] = turn
+            a_hp[pos[ended]] = hp[0][ended]
+            keep = ~ended
+            pos = pos[keep]
+            for arrays in (hp, shock, exposed):
+                arrays[:] = [x[keep] for x in arrays]
+            if not len(pos):
+                break
+    a_hp[pos] = hp[0]  # fights still going at the turn limit
+    a_loss = a.hp - a_hp
+    if b.poison is not None:
+        victims = poisoned & ~a_dead
+        if victims.any():
+            a_loss[victims] += poison_cycles(rng, b.poison, a.ht, int(victims.sum()))
+    return a_won, a_loss, turns, a_dead
+
+
+def simulate(encounter, n, rng):
+    """Play ``encounter`` ``n`` times; return an :class:`Outcome`."""
+    out = Outcome.empty(n)
+    pc = encounter.pc
+    for step in encounter.steps:
+        if step.kind == "fight":
+            won, loss, turns, dead = simulate_fight(rng, pc, step.foe, n)
+            passed = won
+            out.hp_loss += loss
+            out.turns += turns
+            out.dead |= dead
+        elif step.kind == "contest":
+            # A tie means neither side wins (p.3): the contest simply goes on.
+            result = quick_contest(rng, step.skill, step.vs, n)
+            rounds = np.ones(n, np.int32)
+            for _ in range(MAX_TURNS - 1):
+                tied = result == 0
+                if not tied.any():
+                    break
+                result[tied] = quick_contest(rng, step.skill, step.vs, int(tied.sum()))
+                rounds[tied] += 1
+            passed = result > 0
+            out.turns += rounds
+            _apply(rng, step.fail, pc, ~passed, out)
+        else:
+            passed = np.ones(n, bool)
+            for _ in range(step.times):
+                done = np.zeros(n, bool)
+                for _ in range(1 + step.retries):
+                    todo = ~done
+                    k = int(todo.sum())
+                    if not k:
+                        break
+                    ok, _, _, fumble = success_roll(rng, step.skill, k)
+                    out.turns[todo] += 1
+                    failed, fumbled = np.zeros(n, bool), np.zeros(n, bool)
+                    failed[todo], fumbled[todo] = ~ok, fumble
+                    _apply(rng, step.critfail or step.fail, pc, fumbled, out)
+                    _apply(rng, step.fail, pc, failed & ~fumbled, out)
+                    done[todo] = ok
+                passed &= done
+        if not step.optional:
+            out.success &= passed
+    return out
+
+
+@dataclass
+class Tally:
+    """Aggregated results; tallies from separate batches or processes add up."""
+
+    n: int = 0
+    successes: int = 0
+    deaths: int = 0
+    hp_loss: int = 0
+    fp_loss: int = 0
+    seconds: float = 0.0
+    turns_hist: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    hp_hist: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+
+    @classmethod
+    def of(cls, outcome, seconds=0.0):
+        return cls(
+            n=len(outcome.success),
+            successes=int(outcome.success.sum()),
+            deaths=int(outcome.dead.sum()),
+            hp_loss=int(outcome.hp_loss.sum()),
+            fp_loss=int(outcome.fp_loss.sum()),
+            seconds=seconds,
+            turns_hist=np.bincount(outcome.turns),
+            hp_hist=np.bincount(np.maximum(outcome.hp_loss, 0)),
+        )
+
+    def __add__(self, other):
+        return Tally(
+            self.n + other.n,
+            self.successes + other.successes,
+            self.deaths + other.deaths,
+            self.hp_loss + other.hp_loss,
+            self.fp_loss + other.fp_loss,
+            self.seconds + other.seconds,
+            _add_hist(self.turns_hist, other.turns_hist),
+            _add_hist(self.hp_hist, other.hp_hist),
+        )
+
+    @staticmethod
+    def quantile(hist, q):
+        if not hist.sum():
+            return 0
+        return int(np.searchsorted(np.cumsum(hist), q * hist.sum()))
+
+    def summary(self):
+        n = self.n or 1
+        return {
+            "success": self.successes / n,
+            "death": self.deaths / n,
+            "hp_loss": self.hp_loss / n,
+            "fp_loss": self.fp_loss / n,
+            "turns_median": self.quantile(self.turns_hist, 0.5),
+            "turns_p90": self.quantile(self.turns_hist, 0.9),
+            "hp_loss_p90": self.quantile(self.hp_hist, 0.9),
+            "rate": self.n / self.seconds if self.seconds else 0.0,
+        }
+
+
+def _add_hist(x, y):
+    if len(x) < len(y):
+        x, y = y, x
+    out = x.copy()
+    out[:len(y)] += y
+    return out
+
+
+def _run_chunk(data, scene_id, n, seed):
+    # Pool task: recompile from plain data (cheap) so only dicts are pickled.
+    encounter = next(e for e in compile_encounters(data) if e.id == scene_id)
+    t0 = time.perf_counter()
+    outcome = simulate(encounter, n, np.random.default_rng(seed))
+    return scene_id, Tally.of(outcome, time.perf_counter() - t0)
+
+
+def run(data, n, seed=None, executor=None, chunk=CHUNK):
+    """``{scene id: Tally}`` for every simulatable scene, ``n`` attempts each.
+
+    With an ``executor`` the attempts are split into chunks of ``chunk`` and
+    run in parallel; each chunk gets an independent random stream.
+    """
+    encounters = compile_encounters(data)
+    root = np.random.SeedSequence(seed)
+    jobs = []
+    for e in encounters:
+        sizes = [chunk] * (n // chunk) + ([n % chunk] if n % chunk else [])
+        jobs += [(e.id, size, s) for size, s in zip(sizes, root.spawn(len(sizes)))]
+    tallies = {e.id: Tally() for e in encounters}
+    if executor is None:
+        results = (_run_chunk(data, *job) for job in jobs)
+    else:
+        results = executor.map(_run_chunk, *zip(*[(data, *job) for job in jobs]))
+    for scene_id, tally in results:
+        tallies[scene_id] += tally
+    return tallies
+
+
+def process_pool(workers=None):
+    # Spawn, like the page renderer: the Streamlit process is full of threads.
+    return ProcessPoolExecutor(
+        max_workers=workers or max(1, (os.cpu_count() or 2) - 1),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def main(argv=None):
+    from pathlib import Path
+
+    import adventures
+
+    parser = argparse.ArgumentParser(description="Estimate how deadly each encounter of an adventure is.")
+    parser.add_argument("adventure", type=Path)
+    parser.add_argument("-n", type=int, default=100_000, help="attempts per encounter")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1, help="processes (1 = run in this one)")
+    args = parser.parse_args(argv)
+
+    data = adventures.load(args.adventure).data
+    t0 = time.perf_counter()
+    if args.workers > 1:
+        with process_pool(args.workers) as pool:
+            tallies = run(data, args.n, args.seed, pool, chunk=max(10_000, args.n // args.workers))
+    else:
+        tallies = run(data, args.n, args.seed)
+    elapsed = time.perf_counter() - t0
+
+    titles = {e.id: e.title for e in compile_encounters(data)}
+    print(f"{'':<28} {'success':>8} {'death':>7} {'HP loss':>8} {'FP loss':>8} {'turns':>9} {'runs/s':>10}")
+    for scene_id, tally in tallies.items():
+        s = tally.summary()
+        print(f"{scene_id + '. ' + titles[scene_id]:<28} {s['success']:>8.1%} {s['death']:>7.2%} "
+              f"{s['hp_loss']:>8.2f} {s['fp_loss']:>8.2f} {s['turns_median']:>4}/{s['turns_p90']:<4} "
+              f"{s['rate']:>10,.0f}")
+    total = sum(t.n for t in tallies.values())
+    print(f"{total:,} attempts in {elapsed:.2f} s ({total / elapsed:,.0f}/s wall)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
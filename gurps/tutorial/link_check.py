@@ -0,0 +1,303 @@
+# link_check.py
+# Validate and re-target the hand-written rule links of one or more adventures
+# against a PDF: [Keyword p.N](#N) in adventure files, or <span class="pdf"
+# data-page="N">Keyword p.N</span> in HTML.
+#
+# The PDF is read once: page texts come from the persisted search index, and a
+# single pass over them collects heading-like lines into a keyword -> pages
+# table (also persisted beside the PDF). Every link is then resolved with
+# dictionary lookups, so hundreds of links across many adventures take
+# milliseconds once the index exists.
+#
+#     python link_check.py "GURPS 4e - Lite.pdf" adventures/*.json --out links.json
+
+import argparse
+import gzip
+import html
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from adventures import LINK_RE as ADVENTURE_LINK_RE, SUFFIXES as ADVENTURE_SUFFIXES
+from page_render import AVAILABLE, file_sha256
+from search_index import SearchIndex, index_path, tokenize
+
+KEYWORD_INDEX_VERSION = 1
+MAX_HEADING_WORDS = 5
+
+_HTML_LINK_RE = re.compile(r'<span class="pdf" data-page="(?P<page>\d+)"[^>]*>(?P<text>[^<]*)</span>')
+_SHORT_LINK_RE = re.compile(ADVENTURE_LINK_RE.pattern.replace("(", "(?P<text>", 1).replace(r"(\d+)", r"(?P<page>\d+)"))
+_PAGE_REF_RE = re.compile(r"p\.\s*(\d+)(?:\s*[-–]\s*(\d+))?")
+_TAG_RE = re.compile(r"<[^>]+>")
+_SHORT_SYNTAX_RE = re.compile(r"\]\(#\d+\)|\[")
+_CONTEXT_SPLIT_RE = re.compile(r"[(·;:,—.>]|\bp\.\s*\d+(?:-\d+)?")
+_RUN_IN_RE = re.compile(r"^([^:]{3,40}):\s")
+# Link words that say nothing about the target; the text before the link does.
+_GENERIC = {"skill", "rules", "rule", "basics", "help", "see", "from", "distance", "helps", "pick"}
+
+
+def stem(token):
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def keyword_tokens(text):
+    return tuple(stem(t) for t in tokenize(text))
+
+
+def _heading(line):
+    """The heading text of a line, if it looks like one (short, title-cased)."""
+    line = line.strip()
+    m = _RUN_IN_RE.match(line)
+    if m:
+        line = m.group(1)
+    words = line.split()
+    if not words or len(words) > MAX_HEADING_WORDS or line[-1] in ".,;":
+        return None
+    if not line[0].isalpha() or not line[0].isupper():
+        return None
+    if any(len(w) > 3 and w[0].isalpha() and not w[0].isupper() for w in words):
+        return None
+    return line
+
+
+class KeywordIndex:
+    """Heading keywords -> pages, built in one pass over the page texts.
+
+    Every heading is stored under each of its leading word prefixes, so
+    "Combat Reflexes" finds "Combat Reflexes 15 points" and "Fright Check"
+    finds "Fright Checks".
+    """
+
+    def __init__(self, headings, sha=""):
+        self.sha = sha
+        self.headings = headings  # {"tok tok": [pages]}
+
+    @classmethod
+    def build(cls, texts, sha=""):
+        headings = {}
+        for page, text in enumerate(texts, start=1):
+            for line in text.splitlines():
+                heading = _heading(line)
+                if heading is None:
+                    continue
+                toks = keyword_tokens(heading)
+                for k in range(1, len(toks) + 1):
+                    pages = headings.setdefault(" ".join(toks[:k]), [])
+                    if not pages or pages[-1] != page:
+                        pages.append(page)
+        return cls(headings, sha)
+
+    @classmethod
+    def load_or_build(cls, pdf_path, sha, search_index=None):
+        path = index_path(pdf_path, sha).with_name(
+            index_path(pdf_path, sha).name.replace(".idx.", ".kw.")
+        )
+        if path.exists():
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == KEYWORD_INDEX_VERSION and data.get("sha") == sha:
+                    return cls(data["headings"], sha)
+            except (OSError, ValueError):
+                pass
+        search_index = search_index or SearchIndex.load_or_build(pdf_path, sha)
+        index = cls.build(search_index.texts, sha)
+        try:
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump({"version": KEYWORD_INDEX_VERSION, "sha": sha, "headings": index.headings}, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # read-only folder: rebuilding from the text index is cheap
+        return index
+
+    def lookup(self, tokens):
+        """Pages with a heading starting with exactly these (stemmed) tokens."""
+        return self.headings.get(" ".join(tokens), [])
+
+
+@dataclass
+class LinkCheck:
+    source: str
+    line: int
+    text: str
+    keyword: str
+    page: int
+    pages: tuple  # pages the link text claims, e.g. (25, 27) for "p.25-27"
+    status: str = "unresolved"  # ok | mismatch | unresolved
+    resolved: int = None
+    via: str = ""  # heading | text
+    candidates: list = field(default_factory=list)
+    from_context: bool = False  # keyword guessed from the words before the link
+
+    @property
+    def suggestion(self):
+        """A guess, not evidence: listed, but never rewritten by --apply."""
+        return self.from_context or self.via == "text"
+
+
+def _keyword_for(markup, start, text):
+    """``(keyword, from_context)`` for the link text starting at ``start``."""
+    words = _PAGE_REF_RE.sub(" ", text)
+    toks = [t for t in tokenize(words) if t not in _GENERIC]
+    if toks:
+        return " ".join(toks), False
+    # "Fatigue basics p.31" style links: use the nearest words before the link.
+    before = markup[max(0, start - 200):start]
+    before = html.unescape(_SHORT_SYNTAX_RE.sub(" ", _TAG_RE.sub(" ", before)))
+    for piece in reversed(_CONTEXT_SPLIT_RE.split(before)):
+        toks = [t for t in tokenize(piece) if t not in _GENERIC]
+        if toks:
+            return " ".join(toks), True
+    return "", True
+
+
+def _variants(tokens):
+    """Contiguous runs of ``tokens``, longest first, down to half the length."""
+    n = len(tokens)
+    for size in range(n, (n + 1) // 2 - 1, -1):
+        for i in range(n - size + 1):
+            yield tokens[i:i + size]
+
+
+def _link_re(source):
+    """Adventure files use [text](#page) links; anything else is HTML."""
+    return _SHORT_LINK_RE if Path(source).suffix.lower() in ADVENTURE_SUFFIXES else _HTML_LINK_RE
+
+
+def scan_links(markup, source=""):
+    """Every rule link in ``markup`` as an unresolved :class:`LinkCheck`."""
+    out = []
+    for m in _link_re(source).finditer(markup):
+        text = html.unescape(m.group("text")).strip()
+        page = int(m.group("page"))
+        ref = _PAGE_REF_RE.search(text)
+        first = int(ref.group(1)) if ref else page
+        last = int(ref.group(2)) if ref and ref.group(2) else first
+        keyword, from_context = _keyword_for(markup, m.start(), text)
+        out.append(LinkCheck(
+            source=source,
+            line=markup.count("\n", 0, m.start()) + 1,
+            text=text,
+            keyword=keyword,
+            page=page,
+            pages=(min(page, first), max(page, last)),
+            from_context=from_context,
+        ))
+    return out
+
+
+def resolve(links, keywords, search):
+    """Fill in status/resolved for each link from the keyword and text indexes."""
+    for link in links:
+        toks = keyword_tokens(link.keyword)
+        if not toks:
+            continue
+        lo, hi = link.pages
+        # A matching heading is authoritative; otherwise fall back to pages
+        # whose text contains the words.
+        pages, via = [], "heading"
+        for v in _variants(toks):
+            pages = keywords.lookup(v)
+            if pages:
+                break
+        if not pages:
+            words = tokenize(link.keyword)
+            for v in _variants(words):
+                pages = [h["page"] for h in search.search(" ".join(v), limit=5, prefix=False)]
+                if pages:
+                    break
+            via = "text"
+        if not pages:
+            continue
+        link.candidates = pages[:8]
+        link.via = via
+        inside = [p for p in pages if lo <= p <= hi]
+        if inside:
+            link.status, link.resolved = "ok", inside[0]
+        else:
+            link.status = "mismatch"
+            link.resolved = min(pages, key=lambda p: (abs(p - link.page), p))
+    return links
+
+
+def apply_fixes(markup, links, source=""):
+    """Rewrite the target page and the "p.N" text of every mismatched link.
+
+    Suggestions (keywords guessed from context, or pages found only by a
+    text search) are left alone.
+    """
+    fixes = {(l.line, l.text): l for l in links if l.status == "mismatch" and not l.suggestion}
+
+    def sub(m):
+        line = markup.count("\n", 0, m.start()) + 1
+        link = fixes.get((line, html.unescape(m.group("text")).strip()))
+        if link is None:
+            return m.group(0)
+        shift = link.resolved - link.page
+        text = _PAGE_REF_RE.sub(
+            lambda r: f"p.{int(r.group(1)) + shift}" + (f"-{int(r.group(2)) + shift}" if r.group(2) else ""),
+            m.group("text"),
+        )
+        # Splice both groups back in, whichever order the syntax puts them in.
+        out, pos = [], m.start()
+        for name, value in sorted((("page", str(link.resolved)), ("text", text)), key=lambda g: m.start(g[0])):
+            out += [markup[pos:m.start(name)], value]
+            pos = m.end(name)
+        return "".join(out) + markup[pos:m.end()]
+
+    return _link_re(source).sub(sub, markup)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check adventure rule links against a PDF and suggest fixes.")
+    parser.add_argument("pdf", type=Path)
+    parser.add_argument("markup", type=Path, nargs="+", help="adventure files containing rule links")
+    parser.add_argument("--out", type=Path, help="write the corrected link table as JSON")
+    parser.add_argument("--apply", action="store_true",
+                        help="rewrite mismatched links in place (suggestions are only listed)")
+    parser.add_argument("--quiet", action="store_true", help="only list mismatches")
+    args = parser.parse_args(argv)
+    if not AVAILABLE:
+        parser.error("pypdfium2 is not installed (pip install pypdfium2)")
+
+    t0 = time.perf_counter()
+    sha = file_sha256(args.pdf)
+    search = SearchIndex.load_or_build(args.pdf, sha)
+    keywords = KeywordIndex.load_or_build(args.pdf, sha, search)
+    t1 = time.perf_counter()
+
+    links = []
+    for path in args.markup:
+        markup = path.read_text(encoding="utf-8")
+        found = resolve(scan_links(markup, str(path)), keywords, search)
+        links.extend(found)
+        if args.apply and any(l.status == "mismatch" and not l.suggestion for l in found):
+            path.write_text(apply_fixes(markup, found, str(path)), encoding="utf-8")
+    t2 = time.perf_counter()
+
+    for link in links:
+        if args.quiet and link.status != "mismatch":
+            continue
+        target = f"-> p.{link.resolved}" if link.resolved else ""
+        status = "suggest" if link.status == "mismatch" and link.suggestion else link.status
+        print(f"{status:<10} {link.source}:{link.line}  {link.text!r} [{link.keyword}] "
+              f"p.{link.page} {target} {link.via}{' (from context)' if link.from_context else ''}")
+    counts = {s: sum(1 for l in links if l.status == s) for s in ("ok", "mismatch", "unresolved")}
+    suggested = sum(1 for l in links if l.status == "mismatch" and l.suggestion)
+    print(f"{len(links)} links: {counts['ok']} ok, {counts['mismatch'] - suggested} mismatched, "
+          f"{suggested} suggestion(s), {counts['unresolved']} unresolved "
+          f"(index {(t1 - t0) * 1000:.0f} ms, resolve {(t2 - t1) * 1000:.1f} ms)")
+    if args.out:
+        args.out.write_text(json.dumps([asdict(l) for l in links], indent=1), encoding="utf-8")
+    return 1 if counts["mismatch"] - suggested else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+# page_render.py
+# Optional server-side page rendering: rasterise PDF pages with pdfium into
+# WebP/PNG images at a few fixed scale buckets, keep them in a content-addressed
+# on-disk cache, and let the viewer swap in a ready image instead of running
+# PDF.js on slow client devices.
+#
+# Needs pypdfium2 (and Pillow); without it the viewer simply renders client-side.
+# Pre-warm the cache for a PDF from the command line:
+#
+#     python page_render.py "GURPS 4e - Lite.pdf" --referenced adventures/tomb_of_the_silver_serpent.json
+
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from pathlib import Path
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # optional dependency
+    pdfium = None
+
+log = logging.getLogger(__name__)
+
+AVAILABLE = pdfium is not None
+# What opening a damaged file or a non-PDF raises.
+PDF_ERRORS = (pdfium.PdfiumError, OSError) if AVAILABLE else (OSError,)
+
+# Device pixels per PDF point. The client picks the smallest bucket that is at
+# least as sharp as what it would have rendered itself (scale * devicePixelRatio).
+SCALE_BUCKETS = (1.0, 1.5, 2.0, 3.0)
+FORMATS = {"webp": "image/webp", "png": "image/png"}
+
+CACHE_DIR = Path(os.environ.get("GURPS_CACHE_DIR", Path.home() / ".cache" / "gurps-tutor"))
+
+_LINK_RE = re.compile(r'data-page="(\d+)"[^>]*>([^<]*)<')
+_SPAN_RE = re.compile(r"p\.\s*(\d+)\s*[-\u2013]\s*(\d+)")
+
+
+def referenced_pages(markup):
+    """Sorted book pages linked from ``data-page`` attributes in ``markup``.
+
+    A link reading e.g. "Maneuvers p.25-27" also pulls in the rest of its span.
+    """
+    pages = set()
+    for page, text in _LINK_RE.findall(markup):
+        first = last = int(page)
+        span = _SPAN_RE.search(text)
+        if span and int(span.group(1)) == first:
+            last = max(first, int(span.group(2)))
+        pages.update(range(first, last + 1))
+    return sorted(pages)
+
+
+def file_sha256(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def page_count(entry):
+    """Number of pages in a cached PDF (a :class:`pdf_cache.PdfEntry`)."""
+    doc = pdfium.PdfDocument(str(entry.path))
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def parse_pages(spec):
+    """Parse ``"3,22-24"`` into ``[3, 22, 23, 24]``."""
+    pages = set()
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        first, _, last = part.partition("-")
+        pages.update(range(int(first), int(last or first) + 1))
+    return sorted(pages)
+
+
+class TileCache:
+    """Content-addressed directory of rendered pages with size-bounded LRU eviction.
+
+    Files are named by a hash of (PDF content hash, page, scale, format), so a
+    different printing of the same file name never hits a stale image. Reads
+    refresh the file's mtime, which eviction uses as the recency order.
+    """
+
+    def __init__(self, root=CACHE_DIR / "tiles", max_bytes=512 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None
+
+    @staticmethod
+    def key(pdf_sha, page, scale, fmt):
+        return hashlib.sha256(f"{pdf_sha}:{page}:{scale:g}:{fmt}".encode("ascii")).hexdigest()
+
+    def path_for(self, key, fmt):
+        return self.root / key[:2] / f"{key}.{fmt}"
+
+    def get(self, key, fmt):
+        path = self.path_for(key, fmt)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def added(self, path):
+        """Account for a file a render worker just wrote, evicting if needed."""
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_total()
+            else:
+                self._total += path.stat().st_size
+            if self._total > self.max_bytes:
+                self._evict(keep=path)
+
+    def _files(self):
+        return [p for p in self.root.glob("*/*") if p.suffix.lstrip(".") in FORMATS]
+
+    def _scan_total(self):
+        return sum(p.stat().st_size for p in self._files())
+
+    def _evict(self, keep):
+        entries = sorted(((p.stat().st_mtime, p) for p in self._files()), key=lambda t: t[0])
+        for _, p in entries:
+            if self._total <= self.max_bytes * 0.9:
+                break
+            if p == keep:
+                continue
+            size = p.stat().st_size
+            p.unlink(missing_ok=True)
+            self._total -= size
+            log.debug("tile cache: evicted %s", p.name)
+
+
+# ---------- worker side (runs in the process pool) ----------
+
+_worker_docs = {}
+
+
+def _render_to_file(pdf_path, pdf_sha, page, scale, fmt, dest):
+    # Documents are keyed on content as well as path: a PDF replaced in place
+    # must not keep rendering from the copy this worker opened before.
+    doc = _worker_docs.get((pdf_path, pdf_sha))
+    if doc is None:
+        # Keep the last document open in this worker; pages of one PDF
+        # usually arrive together.
+        for old in _worker_docs.values():
+            old.close()
+        _worker_docs.clear()
+        if file_sha256(pdf_path) != pdf_sha:
+            raise ValueError(f"{pdf_path} changed since it was hashed; not rendering it under the old key")
+        doc = _worker_docs[(pdf_path, pdf_sha)] = pdfium.PdfDocument(pdf_path)
+    image = doc[page - 1].render(scale=scale).to_pil()
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f"{dest.name}.{os.getpid()}.tmp")
+    if fmt == "webp":
+        image.save(tmp, format="WEBP", quality=85, method=4)
+    else:
+        image.save(tmp, format="PNG", optimize=False)
+    os.replace(tmp, dest)
+    return str(dest)
+
+
+class PageRenderer:
+    """Render pages into a :class:`TileCache` using a background process pool.
+
+    ``lookup`` never blocks on rendering: a miss schedules the page (once, even
+    if many clients ask for it) and returns None, so callers can fall back to
+    client-side rendering until the image is ready.
+    """
+
+    def __init__(self, cache=None, workers=None, fmt="webp"):
+        if not AVAILABLE:
+            raise RuntimeError("server-side rendering needs pypdfium2")
+        self.cache = cache or TileCache()
+        self.fmt = fmt
+        # Spawn, not fork: the Streamlit process is full of threads.
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers or max(1, (os.cpu_count() or 2) - 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, pdf_path, pdf_sha, page, scale):
+        """Return the cached image path, or None after scheduling the render."""
+        key = self.cache.key(pdf_sha, page, scale, self.fmt)
+        path = self.cache.get(key, self.fmt)
+        if path is None:
+            self.submit(pdf_path, pdf_sha, page, scale)
+        return path
+
+    def submit(self, pdf_path, pdf_sha, page, scale):
+        key = self.cache.key(pdf_sha, page, scale, self.fmt)
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            if self.cache.get(key, self.fmt) is not None:
+                return None
+            dest = self.cache.path_for(key, self.fmt)
+            fut = self._pool.submit(_render_to_file, str(pdf_path), pdf_sha, page, scale, self.fmt, str(dest))
+            self._inflight[key] = fut
+        fut.add_done_callback(lambda f: self._done(key, f))
+        return fut
+
+    def prewarm(self, pdf_path, pdf_sha, pages, scales=SCALE_BUCKETS):
+        return [f for page in pages for s in scales if (f := self.submit(pdf_path, pdf_sha, page, s))]
+
+    def _done(self, key, fut):
+        with self._lock:
+            self._inflight.pop(key, None)
+        try:
+            self.cache.added(Path(fut.result()))
+        except Exception:
+            log.exception("page render failed")
+
+    def shutdown(self):
+        self._pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-render PDF pages into the tile cache.")
+    parser.add_argument("pdf", type=Path)
+    pick = parser.add_mutually_exclusive_group()
+    pick.add_argument("--pages", help='pages to render, e.g. "3,22-24" (default: all)')
+    pick.add_argument("--referenced", type=Path, metavar="FILE",
+                      help="render only pages linked from FILE (an adventure or HTML)")
+    parser.add_argument("--scales", default=",".join(f"{s:g}" for s in SCALE_BUCKETS))
+    parser.add_argument("--format", choices=sorted(FORMATS), default="webp")
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR / "tiles")
+    parser.add_argument("--max-mb", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if not AVAILABLE:
+        parser.error("pypdfium2 is not installed (pip install pypdfium2 pillow)")
+    scales = [float(s) for s in args.scales.split(",")]
+    if args.pages:
+        pages = parse_pages(args.pages)
+    elif args.referenced:
+        from adventures import markup_for  # not needed by the render workers
+
+        pages = referenced_pages(markup_for(args.referenced))
+    else:
+        doc = pdfium.PdfDocument(str(args.pdf))
+        pages = list(range(1, len(doc) + 1))
+        doc.close()
+
+    cache = TileCache(args.cache_dir, max_bytes=args.max_mb * 1024 * 1024)
+    renderer = PageRenderer(cache, workers=args.workers, fmt=args.format)
+    sha = file_sha256(args.pdf)
+    futures = renderer.prewarm(args.pdf.resolve(), sha, pages, scales)
+    wait(futures)
+    renderer.shutdown()
+    failed = sum(1 for f in futures if f.exception() is not None)
+    print(f"{len(pages)} page(s) x {len(scales)} scale(s): "
+          f"{len(futures) - failed} rendered, {failed} failed, cache at {cache.root}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# pdf_cache.py
+# Process-wide cache for the rulebook PDF and everything derived from it
+# (base64 payload, assembled viewer HTML, ...).
+#
+# One instance is shared by every Streamlit session on the server, so N users
+# reading the same file cost one copy of the data, and reruns that change
+# nothing (e.g. typing in the sidebar) skip the read/encode work entirely.
+
+import base64
+import hashlib
+import logging
+import mmap
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _nbytes(value):
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (mmap.mmap, memoryview)):
+        return len(value)
+    # Larger derived objects (e.g. a SearchIndex) report their own size.
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+@dataclass
+class PdfEntry:
+    """One cached PDF: a read-only memory map of the file plus derived values."""
+
+    key: tuple  # (resolved path, size, mtime_ns)
+    path: Path
+    data: object  # mmap.mmap, or b"" for an empty file
+    derived: dict = field(default_factory=dict)
+    building: dict = field(default_factory=dict, repr=False)  # name -> Lock
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.size + sum(_nbytes(v) for v in self.derived.values())
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    resident: int = 0
+
+
+class PdfCache:
+    """LRU of :class:`PdfEntry` objects, bounded by a total byte budget.
+
+    Entries are keyed on ``(resolved path, size, mtime)`` so replacing the PDF
+    on disk is picked up on the next rerun. The most recently used entry is
+    never evicted, even if it alone exceeds the budget.
+
+    Evicting an entry only drops the cache's reference: sessions and server
+    threads may still hold it, and its map is closed by GC once they let go.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = CacheStats()
+
+    @staticmethod
+    def key_for(path):
+        resolved = Path(path).resolve()
+        st = resolved.stat()
+        return (str(resolved), st.st_size, st.st_mtime_ns)
+
+    def get(self, path):
+        """Return the entry for ``path``, mapping the file on a miss."""
+        key = self.key_for(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return entry
+
+            self._stats.misses += 1
+            # A new size/mtime for a known path means the file was replaced.
+            for stale in [k for k in self._entries if k[0] == key[0]]:
+                del self._entries[stale]
+            entry = PdfEntry(key=key, path=Path(key[0]), data=self._map(key[0]))
+            self._entries[key] = entry
+            log.info("pdf cache: loaded %s (%d bytes)", key[0], entry.size)
+            self._evict()
+            return entry
+
+    def derive(self, entry, name, fn):
+        """Return ``fn(entry)``, computed once per entry and cached under ``name``.
+
+        Derived values count towards the byte budget and are dropped together
+        with their entry, or least recently used first when a single entry
+        outgrows the budget (e.g. one assembled page per adventure).
+
+        ``fn`` runs outside the cache lock, so a slow value (a search index,
+        a subset PDF) only holds up the callers waiting for that same value.
+        """
+        with self._lock:
+            value = self._lookup(entry, name)
+            if value is not _MISSING:
+                return value
+            guard = entry.building.setdefault(name, threading.Lock())
+        with guard:
+            with self._lock:
+                # Someone else may have built it while we waited.
+                value = self._lookup(entry, name)
+                if value is not _MISSING:
+                    return value
+                self._stats.misses += 1
+            try:
+                value = fn(entry)
+            except BaseException:
+                with self._lock:
+                    entry.building.pop(name, None)
+                raise
+            # Publish the value and retire the guard together, so nobody can
+            # slip in between and start a second computation.
+            with self._lock:
+                entry.derived[name] = value
+                entry.building.pop(name, None)
+                if entry.key in self._entries:
+                    self._entries.move_to_end(entry.key)
+                    self._evict(keep=name)
+            return value
+
+    def _lookup(self, entry, name):
+        if name not in entry.derived:
+            return _MISSING
+        self._stats.hits += 1
+        entry.derived[name] = value = entry.derived.pop(name)
+        return value
+
+    def b64(self, entry):
+        """Base64 text of the PDF, as embedded in the inline viewer."""
+        return self.derive(entry, "b64", lambda e: base64.b64encode(e.data).decode("ascii"))
+
+    def sha256(self, entry):
+        """Hex SHA-256 of the PDF contents, for content-addressed caches."""
+        return self.derive(entry, "sha256", lambda e: hashlib.sha256(e.data).hexdigest())
+
+    def stats(self):
+        with self._lock:
+            return CacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._stats.evictions,
+                entries=len(self._entries),
+                resident=sum(e.nbytes for e in self._entries.values()),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _map(path):
+        with open(path, "rb") as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # mmap refuses empty files.
+                return b""
+
+    def _evict(self, keep=None):
+        total = sum(e.nbytes for e in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry.nbytes
+            self._stats.evictions += 1
+            log.info("pdf cache: evicted %s", key[0])
+        if total > self.max_bytes and self._entries:
+            entry = next(reversed(self._entries.values()))
+            for name in [n for n in entry.derived if n != keep]:
+                if total <= self.max_bytes:
+                    break
+                total -= _nbytes(entry.derived.pop(name))
+                self._stats.evictions += 1
+                log.debug("pdf cache: dropped %r of %s", name, entry.key[0])
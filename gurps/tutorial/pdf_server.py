@@ -0,0 +1,396 @@
+# pdf_server.py
+# Small side-car HTTP server that hands the rulebook to PDF.js with support
+# for HTTP Range requests, so the browser only fetches the byte ranges it needs
+# for the pages actually shown instead of the whole file inlined as base64.
+#
+# Runs in a daemon thread next to Streamlit and reads from the shared PdfCache.
+# It also serves the pinned PDF.js bundle (see pdfjs_assets.py) with long-lived
+# cache headers, so the viewer never depends on an external CDN, and, when a
+# PageRenderer is attached, pre-rendered page images (see page_render.py).
+# Full-text queries are answered from the persisted index in search_index.py,
+# and render telemetry posted by the viewer goes to an attached Telemetry
+# collector (see telemetry.py).
+
+import hashlib
+import json
+import logging
+import mimetypes
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from page_render import AVAILABLE as PDFIUM_AVAILABLE, FORMATS, PDF_ERRORS, SCALE_BUCKETS, page_count
+from search_index import SearchIndex
+
+log = logging.getLogger(__name__)
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CHUNK = 256 * 1024
+_MAX_POST = 256 * 1024
+_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def parse_range(header, size):
+    """Parse a single-range ``Range`` header against a resource of ``size`` bytes.
+
+    Returns ``(start, end)`` (inclusive), ``None`` if the header should be
+    ignored (absent, malformed or multi-range: serve the whole file), or
+    ``(None, None)`` if the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    m = _RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    first, last = m.group(1), m.group(2)
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes.
+        start = max(0, size - int(last))
+        end = size - 1
+    if start >= size or start > end:
+        return (None, None)
+    return (start, end)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "GURPSTutor"
+
+    def log_message(self, fmt, *args):
+        log.debug("%s - %s", self.address_string(), fmt % args)
+
+    def _cors(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Headers", "Range, Content-Type")
+        self.send_header(
+            "Access-Control-Expose-Headers",
+            "Accept-Ranges, Content-Range, Content-Length, Content-Encoding",
+        )
+        self.send_header("Timing-Allow-Origin", "*")
+
+    def _empty(self, status, headers=()):
+        self.send_response(status)
+        self._cors()
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._cors()
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, POST, OPTIONS")
+        self.send_header("Access-Control-Max-Age", "86400")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._dispatch(head=True)
+
+    def do_GET(self):
+        self._dispatch(head=False)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self._empty(411)
+        if length < 0:
+            self.close_connection = True
+            return self._empty(400)
+        if length > _MAX_POST:
+            self.close_connection = True
+            return self._empty(413)
+        body = self.rfile.read(length)
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "telemetry":
+            return self._receive_telemetry(parts[1], body)
+        self._empty(404)
+
+    def _receive_telemetry(self, key, body):
+        telemetry = self.server.app.telemetry_for(key)
+        if telemetry is None:
+            return self._empty(404)
+        try:
+            # sendBeacon posts text/plain, so the body is parsed whatever the type says.
+            telemetry.record(json.loads(body))
+        except (TypeError, ValueError):
+            return self._empty(400)
+        self._empty(204)
+
+    def _dispatch(self, head):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) >= 2 and parts[0] == "pdf":
+            return self._serve_pdf(unquote(parts[1]), head)
+        if len(parts) == 2 and parts[0] == "search":
+            return self._serve_search(parts[1], parse_qs(url.query), head)
+        if len(parts) == 4 and parts[0] == "tile":
+            return self._serve_tile(parts[1], parts[2], parts[3], head)
+        if len(parts) >= 3 and parts[0] == "static":
+            return self._serve_static(parts[1], unquote("/".join(parts[2:])), head)
+        self._empty(404)
+
+    def _serve_static(self, mount, name, head):
+        path = self.server.app.static_file(mount, name)
+        if path is None:
+            return self._empty(404)
+        tag = f'"{mount}-{path.stat().st_mtime_ns:x}"'
+        if self.headers.get("If-None-Match") == tag:
+            return self._empty(304, [("ETag", tag), ("Cache-Control", _IMMUTABLE)])
+        data = path.read_bytes()
+        ctype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.send_response(200)
+        self._cors()
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", tag)
+        # Mount names are versioned (e.g. "pdfjs-3.11.174"), so cache for good.
+        self.send_header("Cache-Control", _IMMUTABLE)
+        self.end_headers()
+        if not head:
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    def _serve_search(self, token, params, head):
+        app = self.server.app
+        path = app.path_for(token)
+        if path is None or not PDFIUM_AVAILABLE:
+            return self._empty(404)
+        query = params.get("q", [""])[0]
+        try:
+            limit = max(1, min(50, int(params.get("limit", ["10"])[0])))
+        except ValueError:
+            return self._empty(400)
+        t0 = time.perf_counter()
+        try:
+            hits = app.search_index(path).search(query, limit=limit)
+        except PDF_ERRORS as exc:
+            log.warning("search index for %s unavailable: %s", path, exc)
+            return self._empty(503)
+        body = json.dumps({
+            "query": query, "hits": hits, "ms": round((time.perf_counter() - t0) * 1000, 2),
+        }).encode("utf-8")
+        self.send_response(200)
+        self._cors()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _serve_tile(self, token, page, scale, head):
+        app = self.server.app
+        renderer, path = app.renderer, app.path_for(token)
+        try:
+            page, scale = int(page), float(scale)
+        except ValueError:
+            return self._empty(400)
+        if renderer is None or path is None or page < 1 or scale not in SCALE_BUCKETS:
+            return self._empty(404)
+        try:
+            entry = app.cache.get(path)
+            if page > app.cache.derive(entry, "page_count", page_count):
+                return self._empty(404)
+            sha = app.cache.sha256(entry)
+        except PDF_ERRORS as exc:
+            log.warning("cannot render tiles for %s: %s", path, exc)
+            return self._empty(503)
+        tile = renderer.lookup(path, sha, page, scale)
+        if tile is None:
+            # Not rendered yet (now scheduled): the client renders it itself.
+            return self._empty(404, [("Retry-After", "1"), ("Cache-Control", "no-store")])
+        try:
+            data = tile.read_bytes()
+        except FileNotFoundError:  # evicted in between
+            return self._empty(404, [("Cache-Control", "no-store")])
+        self.send_response(200)
+        self._cors()
+        self.send_header("Content-Type", FORMATS[renderer.fmt])
+        self.send_header("Content-Length", str(len(data)))
+        # The token pins the file version, so the image never changes.
+        self.send_header("Cache-Control", _IMMUTABLE)
+        self.end_headers()
+        if not head:
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    def _serve_pdf(self, token, head):
+        app = self.server.app
+        path = app.path_for(token)
+        if path is None:
+            return self._empty(404)
+        try:
+            entry = app.cache.get(path)
+        except OSError:
+            return self._empty(404)
+        if app.token_of(entry.key) != token:  # replaced since path_for() looked
+            return self._empty(404)
+        data, size = entry.data, entry.size
+
+        rng = parse_range(self.headers.get("Range"), size)
+        if rng == (None, None):
+            return self._empty(416, [("Content-Range", f"bytes */{size}")])
+        if rng is None:
+            status, start, end = 200, 0, size - 1
+        else:
+            status, (start, end) = 206, rng
+        length = end - start + 1 if size else 0
+
+        self.send_response(status)
+        self._cors()
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", f'"{token}"')
+        self.send_header("Cache-Control", "private, max-age=3600")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head:
+            return
+
+        sent = 0
+        try:
+            # PDF.js aborts its initial full GET once it sees Accept-Ranges,
+            # so write in chunks and stop quietly when the client goes away.
+            for off in range(start, end + 1, _CHUNK):
+                chunk = data[off:min(off + _CHUNK, end + 1)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            app.count(token, sent)
+
+
+class PdfServer:
+    """Serve cached PDFs at ``/pdf/<token>/<name>`` with Range support, and
+    versioned static assets at ``/static/<mount>/<name>``."""
+
+    def __init__(self, cache, host="0.0.0.0", port=0):
+        self.cache = cache
+        self.renderer = None
+        self.telemetry = None
+        self._telemetry_key = secrets.token_hex(8)
+        self._paths = {}
+        self._static = {}
+        self._sent = {}
+        self._requests = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.app = self
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="pdf-server", daemon=True
+        )
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        log.info("pdf server listening on port %d", self.port)
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def attach_renderer(self, renderer):
+        """Serve ``/tile/<token>/<page>/<scale>`` images from ``renderer``."""
+        self.renderer = renderer
+
+    def attach_telemetry(self, telemetry):
+        """Accept viewer telemetry into ``telemetry``; returns the URL path to post to.
+
+        The path carries a per-process random key, so only pages this app
+        served can report.
+        """
+        self.telemetry = telemetry
+        return f"/telemetry/{self._telemetry_key}"
+
+    def telemetry_for(self, key):
+        if self.telemetry is None or not secrets.compare_digest(key, self._telemetry_key):
+            return None
+        return self.telemetry
+
+    def register(self, path):
+        """Expose ``path`` and return its URL path (relative to the server root).
+
+        The token covers size and mtime, so a replaced file gets a fresh URL
+        and browsers never mix byte ranges from two versions.
+        """
+        token = self.token_for(path)
+        return f"/pdf/{token}/{quote(Path(path).name)}"
+
+    def token_for(self, path):
+        key = self.cache.key_for(path)
+        token = self.token_of(key)
+        with self._lock:
+            self._paths[token] = key
+        return token
+
+    @staticmethod
+    def token_of(key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+
+    def mount_static(self, mount, directory, names):
+        """Serve the listed files of ``directory`` at ``/static/<mount>/<name>``."""
+        with self._lock:
+            self._static[mount] = (Path(directory), frozenset(names))
+        return f"/static/{quote(mount)}"
+
+    def static_file(self, mount, name):
+        with self._lock:
+            directory, names = self._static.get(mount, (None, ()))
+        if name not in names:
+            return None
+        path = directory / name
+        return path if path.is_file() else None
+
+    def search_index(self, path):
+        """The :class:`SearchIndex` for ``path``, loaded or built once per file version."""
+        entry = self.cache.get(path)
+        return self.cache.derive(
+            entry, "search_index", lambda e: SearchIndex.load_or_build(e.path, self.cache.sha256(e))
+        )
+
+    def path_for(self, token):
+        """The file behind ``token``, or None if unknown or since replaced on disk."""
+        with self._lock:
+            key = self._paths.get(token)
+        if key is None:
+            return None
+        try:
+            current = self.cache.key_for(key[0])
+        except OSError:
+            current = None
+        if current != key:
+            # Old URLs must never serve bytes of a newer version of the file.
+            with self._lock:
+                self._paths.pop(token, None)
+            return None
+        return key[0]
+
+    def count(self, token, nbytes):
+        with self._lock:
+            self._requests += 1
+            self._sent[token] = self._sent.get(token, 0) + nbytes
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self._requests, "bytes_sent": sum(self._sent.values())}
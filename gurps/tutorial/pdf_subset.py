@@ -0,0 +1,93 @@
+# pdf_subset.py
+# Build a slimmed PDF holding only the pages the adventure links to, and remap
+# the adventure's data-page links onto it. The toolbar keeps showing the
+# original book page numbers via the page label table.
+#
+# Needs pypdfium2; subsets are cached on disk by source hash and page list.
+#
+#     python pdf_subset.py "GURPS 4e - Lite.pdf" adventures/tomb_of_the_silver_serpent.json
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+from pathlib import Path
+
+from adventures import markup_for
+from page_render import CACHE_DIR, AVAILABLE, file_sha256, pdfium, referenced_pages
+
+SUBSET_DIR = CACHE_DIR / "subsets"
+
+_DATA_PAGE_RE = re.compile(r'data-page="(\d+)"')
+
+
+def subset_path(src_sha, pages, out_dir=SUBSET_DIR):
+    pages_key = hashlib.sha1(",".join(map(str, pages)).encode("ascii")).hexdigest()[:12]
+    return Path(out_dir) / f"{src_sha[:24]}-{pages_key}.pdf"
+
+
+def build_subset(src_path, src_sha, pages, out_dir=SUBSET_DIR):
+    """Write (once) a PDF of ``pages`` (1-based book pages); return ``(path, labels)``.
+
+    Pages beyond the end of the source are dropped; ``labels`` gives the book
+    page for each page of the subset, in order.
+    """
+    if not AVAILABLE:
+        raise RuntimeError("building a subset PDF needs pypdfium2")
+    src = pdfium.PdfDocument(str(src_path))
+    try:
+        labels = [p for p in pages if 1 <= p <= len(src)]
+        dest = subset_path(src_sha, labels, out_dir)
+        if not dest.exists():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            out = pdfium.PdfDocument.new()
+            try:
+                out.import_pages(src, [p - 1 for p in labels])
+                tmp = dest.with_name(f"{dest.name}.{os.getpid()}.tmp")
+                out.save(str(tmp))
+                os.replace(tmp, dest)
+            finally:
+                out.close()
+    finally:
+        src.close()
+    return dest, labels
+
+
+def remap_links(markup, labels):
+    """Point every ``data-page`` at its index in the subset.
+
+    The original number is kept in ``data-book-page`` for tooltips. Links to
+    pages the subset does not have (past the end of the book) lose their
+    ``data-page``, so the viewer shows them as plain text rather than opening
+    whatever subset page happens to have that index.
+    """
+    index = {book: i for i, book in enumerate(labels, start=1)}
+
+    def sub(m):
+        book = int(m.group(1))
+        if book not in index:
+            return f'data-book-page="{book}"'
+        return f'data-page="{index[book]}" data-book-page="{book}"'
+
+    return _DATA_PAGE_RE.sub(sub, markup)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a PDF of only the pages an adventure links to.")
+    parser.add_argument("pdf", type=Path)
+    parser.add_argument("markup", type=Path, help="adventure file (or HTML with data-page links)")
+    parser.add_argument("--out-dir", type=Path, default=SUBSET_DIR)
+    args = parser.parse_args(argv)
+    if not AVAILABLE:
+        parser.error("pypdfium2 is not installed (pip install pypdfium2)")
+
+    pages = referenced_pages(markup_for(args.markup))
+    dest, labels = build_subset(args.pdf, file_sha256(args.pdf), pages, args.out_dir)
+    before, after = args.pdf.stat().st_size, dest.stat().st_size
+    print(f"{len(labels)} page(s): {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB  {dest}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
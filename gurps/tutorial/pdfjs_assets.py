@@ -0,0 +1,141 @@
+# pdfjs_assets.py
+# Pinned local copy of PDF.js (library + worker), so the viewer starts without
+# reaching cdn.jsdelivr.net. The bundle is not in the repository; fetch it on a
+# connected machine before packaging the app:
+#
+#     python pdfjs_assets.py
+#
+# The tarball is checked against the integrity hash npm published for
+# PDFJS_VERSION, and the extracted files' SHA-256 digests are recorded in
+# pdfjs.lock.json on the first run; later runs (and other machines, once the
+# lock is committed) must reproduce exactly those files. Ship
+# static/pdfjs/<version>/ with the app. The app only serves a local bundle
+# whose files match the lock; anything else (missing, unpinned, modified)
+# falls back to the CDN.
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import sys
+import tarfile
+import urllib.request
+from pathlib import Path
+
+PDFJS_VERSION = "3.11.174"
+PDFJS_FILES = ("pdf.min.js", "pdf.worker.min.js")
+PDFJS_DIR = Path(__file__).resolve().parent / "static" / "pdfjs" / PDFJS_VERSION
+PDFJS_CDN = f"https://cdn.jsdelivr.net/npm/pdfjs-dist@{PDFJS_VERSION}/build"
+PDFJS_TARBALL = f"https://registry.npmjs.org/pdfjs-dist/-/pdfjs-dist-{PDFJS_VERSION}.tgz"
+PDFJS_METADATA = f"https://registry.npmjs.org/pdfjs-dist/{PDFJS_VERSION}"
+# {"version", "source", "integrity", "sha256": {file name: hex digest}}, written
+# by the first verified fetch (or --pin).
+PDFJS_LOCK = Path(__file__).resolve().with_name("pdfjs.lock.json")
+
+_verified = {}  # (path, size, mtime_ns) -> digest
+
+
+def pinned_digests(lock=PDFJS_LOCK):
+    """``{file name: sha256}`` recorded for PDFJS_VERSION, or ``{}`` if not pinned."""
+    try:
+        data = json.loads(Path(lock).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != PDFJS_VERSION:
+        return {}
+    digests = data.get("sha256") or {}
+    return digests if set(digests) == set(PDFJS_FILES) else {}
+
+
+def _digest(path):
+    st = path.stat()
+    key = (str(path), st.st_size, st.st_mtime_ns)
+    if key not in _verified:
+        _verified[key] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return _verified[key]
+
+
+def local_pdfjs_dir():
+    """Return the local PDF.js folder if every file matches its pinned digest, else None."""
+    digests = pinned_digests()
+    if not digests:
+        return None
+    try:
+        if all(_digest(PDFJS_DIR / name) == digests[name] for name in PDFJS_FILES):
+            return PDFJS_DIR
+    except OSError:
+        pass
+    return None
+
+
+def published_integrity(url=PDFJS_METADATA):
+    """The Subresource Integrity string (``sha512-…``) npm lists for PDFJS_VERSION."""
+    with urllib.request.urlopen(url, timeout=60) as resp:
+        meta = json.load(resp)
+    integrity = (meta.get("dist") or {}).get("integrity", "")
+    if meta.get("version") != PDFJS_VERSION or not integrity.startswith("sha512-"):
+        raise RuntimeError(f"{url} lists no sha512 integrity for pdfjs-dist {PDFJS_VERSION}")
+    return integrity
+
+
+def _check_integrity(payload, integrity, url):
+    expected = base64.b64decode(integrity.split("-", 1)[1])
+    if hashlib.sha512(payload).digest() != expected:
+        raise RuntimeError(f"{url} does not match the integrity npm published for pdfjs-dist {PDFJS_VERSION}")
+
+
+def fetch(dest=PDFJS_DIR, url=PDFJS_TARBALL, pin=False):
+    """Download the pinned pdfjs-dist tarball and extract the build files.
+
+    Every file must match the digests in PDFJS_LOCK. Without a lock (or with
+    ``pin``) the tarball is checked against npm's published integrity hash
+    instead, and the lock is written from it.
+    """
+    digests = {} if pin else pinned_digests()
+    integrity = None if digests else published_integrity()
+    with urllib.request.urlopen(url, timeout=60) as resp:
+        payload = resp.read()
+    if integrity:
+        _check_integrity(payload, integrity, url)
+    files = {}
+    with tarfile.open(fileobj=io.BytesIO(payload), mode="r:gz") as tar:
+        for name in PDFJS_FILES:
+            member = tar.extractfile(f"package/build/{name}")
+            if member is None:
+                raise RuntimeError(f"{name} missing from {url}")
+            files[name] = member.read()
+    # The library announces its version; refuse anything but the pin.
+    if PDFJS_VERSION.encode("ascii") not in files["pdf.min.js"]:
+        raise RuntimeError(f"{url} is not pdfjs-dist {PDFJS_VERSION}")
+    actual = {name: hashlib.sha256(data).hexdigest() for name, data in files.items()}
+    for name in PDFJS_FILES:
+        if digests and actual[name] != digests[name]:
+            raise RuntimeError(f"{name} from {url} does not match the digest in {PDFJS_LOCK.name}")
+    dest.mkdir(parents=True, exist_ok=True)
+    for name, data in files.items():
+        (dest / name).write_bytes(data)
+    if integrity:
+        lock = {"version": PDFJS_VERSION, "source": url, "integrity": integrity, "sha256": actual}
+        PDFJS_LOCK.write_text(json.dumps(lock, indent=2) + "\n", encoding="utf-8")
+    return dest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"Fetch pdfjs-dist {PDFJS_VERSION} for offline use.")
+    parser.add_argument("--dest", type=Path, default=PDFJS_DIR)
+    parser.add_argument("--url", default=PDFJS_TARBALL)
+    parser.add_argument("--pin", action="store_true",
+                        help=f"re-record {PDFJS_LOCK.name} from npm's integrity hash (after a version bump)")
+    args = parser.parse_args(argv)
+    try:
+        dest = fetch(args.dest, args.url, pin=args.pin)
+    except (RuntimeError, OSError) as exc:
+        parser.error(str(exc))
+    for name in PDFJS_FILES:
+        print(f"{dest / name}  {(dest / name).stat().st_size} bytes  sha256 {_digest(dest / name)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
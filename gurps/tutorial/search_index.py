@@ -0,0 +1,258 @@
+# search_index.py
+# Full-text search over the rulebook. Text is extracted per page once (with
+# pdfium), turned into a compact inverted index (term -> pages -> positions)
+# and persisted next to the PDF, keyed by the file's hash, so later startups
+# load it instead of re-parsing the PDF.
+#
+#     python search_index.py "GURPS 4e - Lite.pdf" "fright check"
+
+import argparse
+import bisect
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+from page_render import AVAILABLE, CACHE_DIR, file_sha256, pdfium
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SPACE_RE = re.compile(r"\s+")
+# pdfium reports line-break hyphens as U+FFFE ("fright\ufffe\r\nened").
+_BREAK_RE = re.compile(r"[\ufffe\u00ad]\s*")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def extract_pages(pdf_path):
+    """Plain text of every page, in order (needs pypdfium2)."""
+    doc = pdfium.PdfDocument(str(pdf_path))
+    try:
+        texts = []
+        for page in doc:
+            textpage = page.get_textpage()
+            texts.append(_BREAK_RE.sub("", textpage.get_text_range()))
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        doc.close()
+
+
+def index_path(pdf_path, sha):
+    """Where the index for ``pdf_path`` lives: beside the PDF, keyed by hash."""
+    pdf_path = Path(pdf_path)
+    return pdf_path.with_name(f".{pdf_path.stem}.{sha[:16]}.idx.json.gz")
+
+
+class SearchIndex:
+    """Inverted index over the pages of one PDF, with BM25 ranking.
+
+    ``postings`` maps a term to ``{page: [positions]}`` (pages are 1-based,
+    positions count tokens within the page).
+    """
+
+    def __init__(self, texts, postings, sha=""):
+        self.sha = sha
+        self.texts = texts
+        self.postings = postings
+        self.vocab = sorted(postings)
+        self.lengths = [len(tokenize(t)) for t in texts]
+        self.avg_len = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.nbytes = self._estimate_nbytes()
+
+    def _estimate_nbytes(self):
+        """Rough in-memory size, so the PdfCache byte budget accounts for the index."""
+        size = sum(sys.getsizeof(t) for t in self.texts) + sys.getsizeof(self.postings)
+        for term, pages in self.postings.items():
+            size += sys.getsizeof(term) + sys.getsizeof(pages)
+            for positions in pages.values():
+                # The list plus one int object per position (small ints are shared;
+                # this errs on the large side).
+                size += sys.getsizeof(positions) + 28 * len(positions)
+        return size
+
+    @classmethod
+    def build(cls, texts, sha=""):
+        postings = {}
+        for page, text in enumerate(texts, start=1):
+            for pos, term in enumerate(tokenize(text)):
+                postings.setdefault(term, {}).setdefault(page, []).append(pos)
+        return cls(texts, postings, sha)
+
+    # ---------- persistence ----------
+
+    def to_json(self):
+        # Positions are delta-encoded; most gaps are small numbers.
+        packed = {}
+        for term, pages in self.postings.items():
+            row = []
+            for page, positions in pages.items():
+                deltas = [positions[0]] + [b - a for a, b in zip(positions, positions[1:])]
+                row.append([page, deltas])
+            packed[term] = row
+        return {"version": INDEX_VERSION, "sha": self.sha, "texts": self.texts, "postings": packed}
+
+    @classmethod
+    def from_json(cls, data):
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"unsupported index version {data.get('version')!r}")
+        postings = {}
+        for term, row in data["postings"].items():
+            pages = {}
+            for page, deltas in row:
+                positions, acc = [], 0
+                for d in deltas:
+                    acc += d
+                    positions.append(acc)
+                pages[page] = positions
+            postings[term] = pages
+        return cls(data["texts"], postings, data.get("sha", ""))
+
+    def save(self, path):
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return cls.from_json(json.load(f))
+
+    @classmethod
+    def load_or_build(cls, pdf_path, sha):
+        """Load the persisted index for this exact file, building it on a miss.
+
+        Falls back to the user cache directory when the PDF's folder is
+        read-only.
+        """
+        candidates = [index_path(pdf_path, sha), CACHE_DIR / "index" / index_path(pdf_path, sha).name]
+        for path in candidates:
+            if path.exists():
+                try:
+                    index = cls.load(path)
+                    if index.sha == sha:
+                        return index
+                except (OSError, ValueError, KeyError):
+                    log.warning("search index: ignoring unreadable %s", path)
+        t0 = time.perf_counter()
+        index = cls.build(extract_pages(pdf_path), sha)
+        log.info("search index: built %s in %.2fs", pdf_path, time.perf_counter() - t0)
+        for path in candidates:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                index.save(path)
+                break
+            except OSError:
+                continue
+        return index
+
+    # ---------- querying ----------
+
+    def expand(self, term, limit=20):
+        """Vocabulary terms starting with ``term`` (for as-you-type search)."""
+        i = bisect.bisect_left(self.vocab, term)
+        out = []
+        while i < len(self.vocab) and self.vocab[i].startswith(term) and len(out) < limit:
+            out.append(self.vocab[i])
+            i += 1
+        return out
+
+    def search(self, query, limit=10, prefix=True):
+        """Ranked hits for ``query``: every term must occur on the page.
+
+        The last term also matches as a prefix when ``prefix`` is set. Pages
+        where the terms appear as a consecutive phrase rank higher.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        groups = [[t] if t in self.postings else [] for t in terms]
+        if prefix:
+            groups[-1] = self.expand(terms[-1]) or groups[-1]
+        if not all(groups):
+            return []
+
+        n_pages = len(self.texts)
+        scores = None
+        for group in groups:
+            group_scores = {}
+            for term in group:
+                pages = self.postings[term]
+                idf = math.log(1 + (n_pages - len(pages) + 0.5) / (len(pages) + 0.5))
+                for page, positions in pages.items():
+                    tf = len(positions)
+                    norm = tf + 1.2 * (0.25 + 0.75 * self.lengths[page - 1] / (self.avg_len or 1))
+                    group_scores[page] = group_scores.get(page, 0.0) + idf * tf * 2.2 / norm
+            if scores is None:
+                scores = group_scores
+            else:
+                scores = {p: s + group_scores[p] for p, s in scores.items() if p in group_scores}
+            if not scores:
+                return []
+
+        if len(groups) > 1:
+            for page in scores:
+                if self._has_phrase(groups, page):
+                    scores[page] *= 2.0
+
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+        matched = sorted({t for g in groups for t in g})
+        return [
+            {"page": page, "score": round(score, 3), "snippet": self.snippet(page, matched), "terms": matched}
+            for page, score in ranked
+        ]
+
+    def _has_phrase(self, groups, page):
+        sets = []
+        for group in groups:
+            positions = set()
+            for term in group:
+                positions.update(self.postings[term].get(page, ()))
+            sets.append(positions)
+        return any(all(start + i in sets[i] for i in range(1, len(sets))) for start in sets[0])
+
+    def snippet(self, page, terms, width=70):
+        text = _SPACE_RE.sub(" ", self.texts[page - 1]).strip()
+        pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, terms)) + r")", re.IGNORECASE)
+        m = pattern.search(text)
+        if not m:
+            return text[: 2 * width]
+        start, end = max(0, m.start() - width), min(len(text), m.end() + width)
+        return ("…" if start else "") + text[start:end] + ("…" if end < len(text) else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build (or load) the search index for a PDF and query it.")
+    parser.add_argument("pdf", type=Path)
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+    if not AVAILABLE:
+        parser.error("pypdfium2 is not installed (pip install pypdfium2)")
+
+    t0 = time.perf_counter()
+    index = SearchIndex.load_or_build(args.pdf, file_sha256(args.pdf))
+    t1 = time.perf_counter()
+    print(f"{len(index.texts)} pages, {len(index.vocab)} terms, ready in {(t1 - t0) * 1000:.0f} ms")
+    if args.query:
+        hits = index.search(args.query, limit=args.limit)
+        print(f"{len(hits)} hit(s) in {(time.perf_counter() - t1) * 1000:.2f} ms")
+        for hit in hits:
+            print(f"  p.{hit['page']:<4} {hit['score']:>7}  {hit['snippet']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
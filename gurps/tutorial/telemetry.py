@@ -0,0 +1,236 @@
+# telemetry.py
+# Render telemetry from the viewer. The page times PDF.js loading, decoding
+# and opening the document, main-thread long tasks, and getPage and rendering
+# for every page it shows, together with the canvas size, devicePixelRatio and
+# whether the page came from its bitmap cache, and posts the events in batches
+# to the side-car server (see pdf_server.py). A Telemetry collector keeps a
+# sliding window of each timing for the app's diagnostics panel and, when given
+# a log path, appends every batch to a JSONL file (normalised: only the
+# accepted events and the fields read here), so sessions can be compared
+# offline:
+#
+#     python telemetry.py ~/.cache/gurps-tutor/telemetry.jsonl
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from numbers import Real
+from pathlib import Path
+
+# Values kept per metric; percentiles describe the most recent ones.
+WINDOW = 2000
+MAX_EVENTS = 500  # per batch
+MAX_SESSIONS = 1000
+
+# (event kind, field) -> metric; "render" timings are split by source below.
+METRICS = {
+    ("load", "pdfjs_ms"): "PDF.js load (ms)",
+    ("load", "open_ms"): "Document open (ms)",
+    ("load", "decode_ms"): "Inline decode (ms)",
+    ("load", "blocked_ms"): "Inline decode, UI thread (ms)",
+    ("first_page", "ms"): "First page (ms)",
+    ("first_page", "long_tasks_ms"): "Long tasks to first page (ms)",
+    ("show", "get_ms"): "getPage (ms)",
+    ("show", "ms"): "Page shown (ms)",
+}
+RENDER_METRICS = {"pdfjs": "Render, PDF.js (ms)", "tile": "Render, server tile (ms)"}
+CANVAS_METRIC = "Canvas (megapixels)"
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of the sorted sequence ``values``."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))]
+
+
+def _number(value):
+    if isinstance(value, Real) and not isinstance(value, bool) and value == value and value >= 0:
+        return float(value)
+    return None
+
+
+def _text(value, limit):
+    return value[:limit] if isinstance(value, str) else ""
+
+
+class Telemetry:
+    """Thread-safe collector for the viewer's telemetry batches."""
+
+    def __init__(self, window=WINDOW, log_path=None):
+        self.window = window
+        self.log_path = Path(log_path) if log_path else None
+        self._values = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = Counter()
+        self._dpr = Counter()
+        self._sessions = OrderedDict()  # session id -> last seen
+        self._lock = threading.Lock()
+
+    def record(self, batch):
+        """Add one batch ``{"session", "mode", "dpr", "events": [...]}``.
+
+        Returns the number of events accepted; malformed events are counted
+        and skipped. Raises ValueError if the batch itself is malformed. Only
+        the accepted events, reduced to the fields read here, are logged.
+        """
+        if not isinstance(batch, dict) or not isinstance(batch.get("events"), list):
+            raise ValueError("telemetry batch must be an object with an events list")
+        events = batch["events"]
+        if len(events) > MAX_EVENTS:
+            raise ValueError(f"telemetry batch has more than {MAX_EVENTS} events")
+        session = _text(batch.get("session"), 64)
+        accepted = []
+        with self._lock:
+            self._counts["batches"] += 1
+            if session:
+                self._sessions[session] = time.time()
+                self._sessions.move_to_end(session)
+                while len(self._sessions) > MAX_SESSIONS:
+                    self._sessions.popitem(last=False)
+            for event in events:
+                event = self._add(event)
+                if event is not None:
+                    accepted.append(event)
+                else:
+                    self._counts["rejected"] += 1
+            self._counts["events"] += len(accepted)
+            log_path = self.log_path
+        if log_path is not None:
+            self._append(log_path, {
+                "received": time.time(),
+                "session": session,
+                "mode": _text(batch.get("mode"), 16),
+                "dpr": _number(batch.get("dpr")),
+                "events": accepted,
+            })
+        return len(accepted)
+
+    def _add(self, event):
+        """Record ``event`` and return its normalised form, or None if rejected."""
+        if not isinstance(event, dict):
+            return None
+        kind = event.get("kind")
+        if not isinstance(kind, str):
+            return None
+        out = {"kind": kind}
+        for field in ("t", "page"):
+            value = _number(event.get(field))
+            if value is not None:
+                out[field] = value
+        if kind == "render":
+            source = event.get("source")
+            metric = RENDER_METRICS.get(source) if isinstance(source, str) else None
+            ms = _number(event.get("ms"))
+            if metric is None or ms is None:
+                return None
+            self._values[metric].append(ms)
+            out.update(source=source, ms=ms)
+            if event.get("prefetch"):
+                self._counts["prefetched"] += 1
+                out["prefetch"] = True
+            return out
+        fields = [(field, metric) for (k, field), metric in METRICS.items() if k == kind]
+        if not fields:
+            return None
+        for field, metric in fields:
+            value = _number(event.get(field))
+            if value is not None:
+                self._values[metric].append(value)
+                out[field] = value
+        if kind == "show":
+            out["hit"] = bool(event.get("hit"))
+            self._counts["cache_hits" if out["hit"] else "cache_misses"] += 1
+            width, height = _number(event.get("width")), _number(event.get("height"))
+            if width and height:
+                self._values[CANVAS_METRIC].append(width * height / 1e6)
+                out.update(width=width, height=height)
+            dpr = _number(event.get("dpr"))
+            if dpr:
+                self._dpr[round(dpr, 2)] += 1
+                out["dpr"] = dpr
+            scroll = _text(event.get("scroll"), 16)
+            if scroll:
+                out["scroll"] = scroll
+        return out
+
+    @staticmethod
+    def _append(path, batch):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(batch, separators=(",", ":")) + "\n"
+        # One write per batch in append mode, so concurrent batches never interleave.
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def summary(self):
+        """``{metric: {"n", "p50", "p90", "p99", "max"}}`` over the current window."""
+        with self._lock:
+            snapshot = {metric: sorted(values) for metric, values in self._values.items()}
+        out = {}
+        for metric in [*METRICS.values(), *RENDER_METRICS.values(), CANVAS_METRIC]:
+            values = snapshot.get(metric)
+            if values:
+                row = {"n": len(values)}
+                row.update({f"p{round(q * 100)}": percentile(values, q) for q in QUANTILES})
+                row["max"] = values[-1]
+                out[metric] = row
+        return out
+
+    def counters(self):
+        with self._lock:
+            counts = dict(self._counts)
+            counts["sessions"] = len(self._sessions)
+            counts["dpr"] = dict(sorted(self._dpr.items()))
+        shown = counts.get("cache_hits", 0) + counts.get("cache_misses", 0)
+        counts["hit_rate"] = counts.get("cache_hits", 0) / shown if shown else 0.0
+        return counts
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._counts.clear()
+            self._dpr.clear()
+            self._sessions.clear()
+
+
+def replay(paths, window=None):
+    """A :class:`Telemetry` filled from JSONL logs written by :meth:`Telemetry.record`."""
+    telemetry = Telemetry(window=window or sys.maxsize)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    telemetry.record(json.loads(line))
+                except ValueError as exc:
+                    print(f"{path}:{n}: skipped ({exc})", file=sys.stderr)
+    return telemetry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise viewer render telemetry from a JSONL log.")
+    parser.add_argument("log", type=Path, nargs="+", help="telemetry log(s) written by the app")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    telemetry = replay(args.log)
+    summary, counts = telemetry.summary(), telemetry.counters()
+    if args.json:
+        print(json.dumps({"metrics": summary, "counters": counts}, indent=2))
+        return 0
+    print(f"{'metric':28} {'n':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for metric, row in summary.items():
+        print(f"{metric:28} {row['n']:7d} {row['p50']:9.1f} {row['p90']:9.1f} {row['p99']:9.1f} {row['max']:9.1f}")
+    print(
+        f"{counts['sessions']} session(s), {counts.get('events', 0)} events · "
+        f"bitmap cache hit rate {counts['hit_rate']:.0%} · devicePixelRatio {counts['dpr']}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())